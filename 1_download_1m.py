@@ -1,20 +1,40 @@
 import pandas as pd
 import ee
-import re
 import pathlib
 from utils import *
-import concurrent.futures
 
 ee.Initialize()
 
 dataframe = pd.read_csv("tables/neon_s2_all_2_images_pairs.csv")
 
-for i, row in dataframe.iterrows():
-    
+# SRF tables, NEON wavelengths and weights are reused across rows and runs
+SPECTRAL_CACHE_DIR = "cache/spectral"
+
+# Maximum number of computePixels requests in flight across all rows
+MAX_IN_FLIGHT = 10
+
+# Write tiles straight into the final tiled GeoTIFF (<neon_ids>.tif) instead of
+# one file per tile plus a warp pass in geotiff.py
+MOSAIC = True
+
+# Spacecraft and NEON wavelengths for all rows in a few bulk requests, stored
+# as columns of the pairs table so later runs only request new rows
+dataframe = prefetch_pair_metadata(dataframe)
+dataframe.to_csv("tables/neon_s2_all_2_images_pairs.csv", index=False)
+
+def build_jobs(row):
+    """Builds the NEON -> S2 graph of a row and returns its (subrequest, target) list."""
+
     x = float(row['x'])
     y = float(row['y'])
 
-    image =  generate_s2_image_from_neon(row['neon_id_gee'], row['s2_id_gee'])
+    image =  generate_s2_image_from_neon(
+        row['neon_id_gee'],
+        row['s2_id_gee'],
+        cache_dir=SPECTRAL_CACHE_DIR,
+        spacecraft=row['s2_spacecraft'],
+        wavelengths=wavelengths_from_str(row['neon_wavelengths'])
+    )
     request = {
         'expression': image,
         'fileFormat': 'GeoTIFF',
@@ -36,79 +56,47 @@ for i, row in dataframe.iterrows():
         }
     }
 
-    try:
-        image = ee.data.computePixels(request)
-    except ee.ee_exception.EEException as ee_error:
-        ee_error_message = str(ee_error)
-
-    match = re.findall(r'\d+', ee_error_message)
-    image_pixel = match[0]
-    max_pixel = match[1]
-    images = int(image_pixel) / int(max_pixel)
-
-    power = 0  # Comienza con 4^0
-    while images > 1:
-        power += 1
-        images = int(image_pixel) / (int(max_pixel) * 4**power)
-        val_split = 4**power
-
-    print(f"Generar {val_split} geotransforms")
-
-
-    request_list = []
-    cell_width = 5160 // 2**power  # 640
-    cell_height = 5160 // 2**power  # 640
-
-    for v in range(2**power):  # Fila
-        print(v)
-        for j in range(2**power):  # Columna
-            # Calcular las nuevas coordenadas de x e y
-            new_x = x + (j * cell_width)
-            new_y = y - (v * cell_height)  # Negativo porque la coordenada Y crece hacia arriba
-
-            # Crear el request para cada subcuadro
-            subrequest = {
-                'expression': image,
-                'fileFormat': 'GeoTIFF',
-                'bandIds': ['B1', 'B2', 'B3', "B4", "B5", "B6", "B7", "B8", "B8A", "B9", "B11", "B12"],
-                'grid': {
-                    'dimensions': {
-                        'width': cell_width,
-                        'height': cell_height
-                    },
-                    'affineTransform': {
-                        'scaleX': 1,
-                        'shearX': 0,
-                        'translateX': new_x,
-                        'shearY': 0,
-                        'scaleY': -1,
-                        'translateY': new_y
-                    },
-                    'crsCode': row['epsg'],
-                }
-            }
-
-            # Agregar el subrequest a la lista
-            request_list.append(subrequest)
-
-
-    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-        future_list = []
-        
-        for n, ulist in enumerate(request_list):
-            # Calcula el path de salida
-            dir = pathlib.Path(f"/data/databases/legacy/OLD_SEN2NAIP/SuperSR/neon_1m/{row['folder']}/{row['neon_id']}/{row['neon_ids']}")
-            dir.mkdir(parents=True, exist_ok=True)
-            full_outname = dir / f"{n:03d}.tif"
-
-            # Envía la tarea al ThreadPool
-            future = executor.submit(fetch_and_save, ulist, full_outname)
-            future_list.append(future)
-
-        # Opcional: esperar a que terminen todas y/o manejar errores
-        for future in concurrent.futures.as_completed(future_list):
-            # Si quieres capturar excepciones individualmente:
-            try:
-                future.result()  
-            except Exception as e:
-                print(f"Error en una de las descargas: {e}")
\ No newline at end of file
+    root = pathlib.Path(f"/data/databases/legacy/OLD_SEN2NAIP/SuperSR/neon_1m/{row['folder']}/{row['neon_id']}/{row['neon_ids']}")
+
+    if MOSAIC:
+        # Windows aligned to the 256 px blocks of the output, so each block is compressed once
+        request['fileFormat'] = 'NUMPY_NDARRAY'
+        planner = TilePlanner(width=5160, height=5160, n_bands=len(request['bandIds']), dtype="float64", align=256)
+        writer = MosaicWriter(
+            root.with_suffix(".tif"),
+            planner.windows(),
+            geotransform=(x, 1, 0, y, 0, -1),
+            crs=row['epsg'],
+            n_bands=len(request['bandIds'])
+        )
+        request_list = planner.subrequests(request)
+        return [(request_list[n], MosaicTile(writer, n)) for n in writer.pending()]
+
+    # Tile grid computed up front from the output size (float64 per band)
+    planner = TilePlanner(width=5160, height=5160, n_bands=len(request['bandIds']), dtype="float64")
+    request_list = planner.subrequests(request)
+
+    # Calcula el path de salida
+    dir = root
+    dir.mkdir(parents=True, exist_ok=True)
+
+    return [(ulist, dir / f"{n:03d}.tif") for n, ulist in enumerate(request_list)]
+
+
+# Retries with backoff and an adaptive (AIMD) concurrency limit
+scheduler = RequestScheduler(max_in_flight=MAX_IN_FLIGHT)
+
+def fetch(ulist, target):
+    if MOSAIC:
+        fetch_into_mosaic(ulist, target, scheduler.wrap(ee.data.computePixels))
+    else:
+        fetch_and_save_adaptive(ulist, target, scheduler.wrap(fetch_and_save))
+
+
+# Per-tile completion state; a restarted run only fetches missing or corrupt tiles
+# (the mosaic writer keeps its own state next to each <neon_ids>.tif.part)
+manifest = None if MOSAIC else DownloadManifest("/data/databases/legacy/OLD_SEN2NAIP/SuperSR/neon_1m/manifest.jsonl")
+
+engine = DownloadEngine(build_jobs, fetch=fetch, max_in_flight=MAX_IN_FLIGHT, manifest=manifest)
+print(engine.run(dataframe))
+print(scheduler.stats)
@@ -0,0 +1,22 @@
+import tacoreader
+import matplotlib.pyplot as plt
+from sen2neon_reader import Sen2NeonReader
+
+dataset = tacoreader.load("tacofoundation:sen2neon")
+
+# Aligned random crops (64x64 LR <-> 256x256 HR), reading only the needed blocks
+idx = 273
+reader = Sen2NeonReader(dataset)
+lr_crop, hr_crop = reader.random_window(idx, size=64, bands=[2, 3, 4]) # Blue, Green, Red
+print(lr_crop.shape, hr_crop.shape)
+
+# Display
+fig, ax = plt.subplots(1, 2, figsize=(10, 5.5))
+ax[0].imshow(lr_crop.transpose(1, 2, 0) / 2000)
+ax[0].set_title(f'LR crop {idx}')
+ax[0].axis('off')
+ax[1].imshow(hr_crop.transpose(1, 2, 0) / 2000)
+ax[1].set_title(f'HR crop {idx}')
+ax[1].axis('off')
+plt.tight_layout()
+plt.show()
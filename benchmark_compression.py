@@ -0,0 +1,24 @@
+import pandas as pd
+from utils import *
+
+# Benchmark of the GeoTIFF compression profiles (COMPRESSION_PROFILES in utils.py)
+# over a few rasters of the updated pairs table
+
+N_SAMPLES = 5
+
+table = pd.read_csv("tables/neon_s2_all_2_images_pairs_updated.csv")
+sample = table.sample(N_SAMPLES, random_state=42)
+
+# NEON (2064x2064, 256 px blocks) and S2 (516x516, 64 px blocks)
+results_neon = benchmark_compression(sample["neon_root_path"].tolist(), block_size=256, window=256)
+results_neon["sensor"] = "neon"
+results_s2 = benchmark_compression(sample["s2_root_path"].tolist(), block_size=64, window=64)
+results_s2["sensor"] = "s2"
+
+results = pd.concat([results_neon, results_s2], ignore_index=True)
+results.to_csv("tables/compression_benchmark.csv", index=False)
+
+summary = results.groupby(["sensor", "profile"])[
+    ["write_mb_s", "size_mb", "ratio", "read_ms_mean", "read_ms_p95"]
+].mean()
+print(summary.round(2))
@@ -0,0 +1,24 @@
+import pandas as pd
+from utils import *
+
+# Pre-decoded training cache: uncompressed .npy shards read with np.memmap
+# (see sen2neon_reader.NpyShardStore), instead of decompressing the ZSTD GeoTIFFs every epoch
+OUT_DIR = "cache/sen2neon_npy"
+BANDS = None          # 1-based bands to keep, e.g. [2, 3, 4, 8]; None keeps all
+DTYPE = "uint16"      # or "float16" (reflectance / 10000, nodata as NaN)
+SHARD_SIZE = 256
+WORKERS = 16
+
+table = pd.read_csv("tables/neon_s2_all_2_images_pairs_updated.csv")
+
+index = export_npy_shards(
+    table["s2_root_path"],
+    table["neon_root_path"],
+    OUT_DIR,
+    ids=table["neon_ids"],
+    bands=BANDS,
+    dtype=DTYPE,
+    shard_size=SHARD_SIZE,
+    workers=WORKERS
+)
+print(f"{len(index)} samples in {index['shard'].nunique()} shards")
@@ -1,28 +1,62 @@
 import pandas as pd
 import pathlib
+import functools
 from osgeo import gdal
 from typing import Union
 from utils import *
 
 table = pd.read_csv("tables/neon_s2_all_2_images_pairs.csv") 
 
+# Process pool for the mosaics: WORKERS processes sharing MAX_CORES GDAL threads
+WORKERS = 8
+MAX_CORES = 40
+GDAL_CACHEMAX_MB = 1024
+
+# See COMPRESSION_PROFILES in utils.py and benchmark_compression.py
+COMPRESSION_PROFILE = "archive"
+
+# Cloud-Optimized GeoTIFF with internal overviews (cheap previews over HTTP range requests)
+COG = False
+OVERVIEW_RESAMPLING = "AVERAGE"
+
+# Profile + band statistics of every output, reused by taco.py and verifique_diff_neons.py
+METADATA_CACHE = "tables/raster_metadata.sqlite"
+
 # For NEON
 root_path = pathlib.Path("/data/databases/legacy/OLD_SEN2NAIP/SuperSR")
 table["neon_root_dir"] = root_path / "neon" / table["folder"] / table["neon_id"] / table["neon_ids"]
-table["neon_root_path"] = table["neon_root_dir"].apply(warp_neon_dir)
+table["neon_root_path"] = run_mosaic_batch(
+    functools.partial(
+        warp_neon_dir,
+        profile=COMPRESSION_PROFILE,
+        cog=COG,
+        overview_resampling=OVERVIEW_RESAMPLING,
+        metadata_cache=METADATA_CACHE
+    ),
+    [(d,) for d in table["neon_root_dir"]],
+    workers=WORKERS,
+    max_cores=MAX_CORES,
+    gdal_cachemax_mb=GDAL_CACHEMAX_MB
+)
 
 # For S2
 root_path = pathlib.Path("/data/databases/legacy/OLD_SEN2NAIP/SuperSR")
 table["s2_root_path_prev"] = root_path / "s2" / table["folder"] / table["neon_id"] / (table["neon_ids"] + ".tiff")
 table["s2_root_path"] = root_path / "sentinel2" / table["folder"] / table["neon_id"] / (table["neon_ids"] + ".tif")
 
-table.apply(
-    lambda row: warp_single_tif(
-        row["s2_root_path_prev"], 
-        row["s2_root_path"]
-    ), 
-    axis=1
-),
+run_mosaic_batch(
+    functools.partial(
+        warp_single_tif,
+        profile=COMPRESSION_PROFILE,
+        cog=COG,
+        overview_resampling=OVERVIEW_RESAMPLING,
+        metadata_cache=METADATA_CACHE
+    ),
+    list(zip(table["s2_root_path_prev"], table["s2_root_path"])),
+    workers=WORKERS,
+    max_cores=MAX_CORES,
+    gdal_cachemax_mb=GDAL_CACHEMAX_MB
+)
 
 table.to_csv("tables/neon_s2_all_2_images_pairs_updated.csv", index=False)
 
@@ -0,0 +1,30 @@
+import json
+import pandas as pd
+from utils import *
+
+# Exact null percentages from the local rasters (see NODATA),
+# instead of the server-side reduceRegion of create_image_with_null_property
+TABLE = "tables/neon_s2_all_2_images_pairs_updated.csv"
+WORKERS = 16
+
+table = pd.read_csv(TABLE)
+
+# Null values of each source: geotiff.py maps NEON nodata to 65535, while the S2
+# block copy keeps the 0 fill of Earth Engine (only warped S2 files use 65535)
+NODATA = {"neon": 65535, "s2": (0, 65535)}
+
+for prefix, nodata in NODATA.items():
+    coverage = null_coverage_table(table[f"{prefix}_root_path"], workers=WORKERS, nodata=nodata)
+    table[f"{prefix}_null_pct"] = coverage["null_pct"]
+    table[f"{prefix}_any_null_pct"] = coverage["any_null_pct"]
+    table[f"{prefix}_band_null_pct"] = coverage["band_null_pct"]
+    print(prefix, coverage["null_pct"].describe())
+
+# neon_val_null was estimated on B001 at 100 m (bestEffort); keep it for reference
+# and replace it with the exact value of the first band
+if "neon_val_null_gee" not in table.columns:
+    table["neon_val_null_gee"] = table["neon_val_null"]
+first_band = table["neon_band_null_pct"].dropna().map(lambda s: json.loads(s)[0])
+table.loc[first_band.index, "neon_val_null"] = first_band
+
+table.to_csv(TABLE, index=False)
@@ -0,0 +1,281 @@
+"""
+Readers of the sen2neon samples for training nodes.
+
+Only depends on NumPy, pandas and GDAL (tacoreader is imported when a dataset
+name is given); none of the download/packaging dependencies of utils.py.
+"""
+import collections
+import concurrent.futures
+import functools
+import json
+import pathlib
+import re
+import threading
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+from osgeo import gdal
+
+
+# ---------------------------------------------------------------------------------------------
+# Windowed LR/HR reads (S2 10 m and NEON 2.5 m share a 4:1 pixel grid)
+class Sen2NeonReader:
+    """
+    Random access to aligned LR (Sentinel-2) / HR (NEON) crops of a sen2neon
+    TACO dataset.
+
+    Only the requested window is read (GDAL decodes just the internal blocks it
+    intersects) and the dataset handles are kept in an LRU, so repeated crops of
+    the same samples do not reopen the remote files.
+
+    Example:
+        reader = Sen2NeonReader("tacofoundation:sen2neon")
+        lr, hr = reader.read_window(273, 64, 64, 64, 64, bands=[2, 3, 4])  # 64x64 LR, 256x256 HR
+    """
+
+    def __init__(self, dataset="tacofoundation:sen2neon", scale: int = 4, max_open: int = 32):
+        if isinstance(dataset, (str, pathlib.Path, list)):
+            import tacoreader  # only needed for reading
+            dataset = tacoreader.load(dataset)
+        self.dataset = dataset
+        self.scale = scale
+        self.sample_paths = functools.lru_cache(maxsize=max_open)(self._sample_paths)
+        self.open = functools.lru_cache(maxsize=2 * max_open)(gdal.Open)
+
+    def __len__(self) -> int:
+        return len(self.dataset)
+
+    def _sample_paths(self, index: int) -> Tuple[str, str]:
+        row = self.dataset.read(index)
+        return row.read(0), row.read(1)
+
+    def shape(self, index: int) -> Tuple[int, int]:
+        """
+        (height, width) of the LR raster of a sample.
+        """
+        lr = self.open(self.sample_paths(index)[0])
+        return lr.RasterYSize, lr.RasterXSize
+
+    def read_window(
+            self,
+            index: int,
+            col_off: int,
+            row_off: int,
+            width: int,
+            height: int,
+            bands: list = None
+        ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Reads a window of the LR raster and the matching window of the HR raster.
+
+        Args:
+            index (int): Sample index.
+            col_off (int): LR column offset.
+            row_off (int): LR row offset.
+            width (int): LR window width.
+            height (int): LR window height.
+            bands (list, optional): 1-based bands to read from both rasters. Defaults to all.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: LR (bands, height, width) and
+                HR (bands, scale * height, scale * width) arrays.
+        """
+        lr_path, hr_path = self.sample_paths(index)
+        lr, hr = self.open(lr_path), self.open(hr_path)
+        if (hr.RasterXSize, hr.RasterYSize) != (self.scale * lr.RasterXSize, self.scale * lr.RasterYSize):
+            raise ValueError(f"Sample {index}: HR is not {self.scale}x the LR grid.")
+        if col_off < 0 or row_off < 0 or col_off + width > lr.RasterXSize or row_off + height > lr.RasterYSize:
+            raise ValueError(f"Sample {index}: window outside the {lr.RasterXSize}x{lr.RasterYSize} LR raster.")
+
+        s = self.scale
+        lr_data = lr.ReadAsArray(col_off, row_off, width, height, band_list=bands)
+        hr_data = hr.ReadAsArray(s * col_off, s * row_off, s * width, s * height, band_list=bands)
+        return lr_data.reshape(-1, height, width), hr_data.reshape(-1, s * height, s * width)
+
+    def random_window(
+            self,
+            index: int,
+            size: int = 64,
+            bands: list = None,
+            rng: np.random.Generator = None
+        ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        `read_window` at a random position: a size x size LR crop and its
+        (scale * size) x (scale * size) HR crop.
+        """
+        rng = np.random.default_rng() if rng is None else rng
+        height, width = self.shape(index)
+        col_off = int(rng.integers(0, width - size + 1))
+        row_off = int(rng.integers(0, height - size + 1))
+        return self.read_window(index, col_off, row_off, size, size, bands)
+
+
+# ---------------------------------------------------------------------------------------------
+# Batch prefetch loader (NumPy + GDAL only)
+def sample_location(path: str) -> Tuple[str, int]:
+    """
+    (file, byte offset) of a "/vsisubfile/<offset>_<size>,<file>" path;
+    (path, 0) for any other path.
+    """
+    match = re.match(r"/vsisubfile/(\d+)_\d+,(.+)", str(path))
+    if match is None:
+        return str(path), 0
+    return match.group(2), int(match.group(1))
+
+
+def _read_batch(
+        local: threading.local,
+        dataset,
+        scale: int,
+        indices: list,
+        bands: list,
+        size: int,
+        rng: np.random.Generator
+    ) -> Tuple[list, np.ndarray, np.ndarray]:
+    # GDAL handles are not shared between threads: one reader per thread
+    if not hasattr(local, "reader"):
+        local.reader = Sen2NeonReader(dataset, scale)
+    reader = local.reader
+
+    lr, hr = [], []
+    for index in indices:
+        if size is None:
+            height, width = reader.shape(index)
+            lr_data, hr_data = reader.read_window(index, 0, 0, width, height, bands)
+        else:
+            lr_data, hr_data = reader.random_window(index, size, bands, rng)
+        lr.append(lr_data)
+        hr.append(hr_data)
+    return indices, np.stack(lr), np.stack(hr)
+
+
+def iter_batches(
+        dataset,
+        indices: list,
+        batch_size: int = 16,
+        bands: list = None,
+        size: int = None,
+        workers: int = 8,
+        prefetch: int = 4,
+        sort: bool = True,
+        scale: int = 4,
+        seed: int = None
+    ):
+    """
+    Yields LR/HR batches of a sen2neon TACO dataset.
+
+    The samples are ordered by part file and byte offset (so each worker reads
+    sequentially), split into batches, and each batch is decoded by a thread
+    of a pool. At most `prefetch` batches are in flight, which bounds memory.
+
+    Args:
+        dataset: tacoreader dataset (or anything `Sen2NeonReader` accepts).
+        indices (list): Sample indices.
+        batch_size (int, optional): Samples per batch. Defaults to 16.
+        bands (list, optional): 1-based bands. Defaults to all.
+        size (int, optional): LR crop size (random aligned crops); None reads the
+            whole rasters, which must then share their shape. Defaults to None.
+        workers (int, optional): Decoding threads. Defaults to 8.
+        prefetch (int, optional): Batches read ahead. Defaults to 4.
+        sort (bool, optional): Reorder `indices` by file and offset. Defaults to True.
+        scale (int, optional): HR / LR resolution ratio. Defaults to 4.
+        seed (int, optional): Seed of the crop positions. Defaults to None.
+
+    Yields:
+        Tuple[list, np.ndarray, np.ndarray]: Sample indices, LR (N, bands, H, W)
+            and HR (N, bands, scale * H, scale * W) arrays.
+
+    Example:
+        for idx, lr, hr in iter_batches(tacoreader.load(files), range(1000), bands=[2, 3, 4], size=64):
+            ...
+    """
+    if isinstance(dataset, (str, pathlib.Path, list)):
+        import tacoreader  # only needed for reading
+        dataset = tacoreader.load(dataset)
+    indices = list(indices)
+
+    if sort:
+        if "internal:subfile" in dataset.columns:
+            locations = {i: sample_location(dataset.iloc[i]["internal:subfile"]) for i in indices}
+        else:
+            reader = Sen2NeonReader(dataset, scale)
+            locations = {i: sample_location(reader.sample_paths(i)[0]) for i in indices}
+        indices = sorted(indices, key=locations.__getitem__)
+
+    local = threading.local()
+    pending = collections.deque()
+    starts = iter(range(0, len(indices), batch_size))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            for start in starts:
+                # One generator per batch: crops are reproducible with `seed` whatever the thread
+                rng = np.random.default_rng(None if seed is None else (seed, start))
+                pending.append(executor.submit(
+                    _read_batch, local, dataset, scale,
+                    indices[start:start + batch_size], bands, size, rng
+                ))
+                if len(pending) >= prefetch:
+                    break
+            if not pending:
+                return
+            yield pending.popleft().result()
+
+
+# ---------------------------------------------------------------------------------------------
+# Pre-decoded .npy shards written by `utils.export_npy_shards`
+class NpyShardStore:
+    """
+    Reader of the shards written by `export_npy_shards`.
+
+    Shards are opened with `np.load(mmap_mode="r")`, so samples and crops are
+    views on the page cache: nothing is decoded or copied until used.
+
+    Example:
+        store = NpyShardStore("cache/sen2neon_npy")
+        lr, hr = store.read_window(0, 16, 16, 64, 64)  # 64x64 LR, 256x256 HR views
+    """
+
+    def __init__(self, root, scale: int = 4):
+        self.root = pathlib.Path(root)
+        self.index = pd.read_parquet(self.root / "index.parquet")
+        self.meta = json.loads((self.root / "meta.json").read_text())
+        self.scale = scale
+        self._shards = {}
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def shard(self, shard: int) -> Tuple[np.ndarray, np.ndarray]:
+        if shard not in self._shards:
+            self._shards[shard] = (
+                np.load(self.root / f"lr_{shard:05d}.npy", mmap_mode="r"),
+                np.load(self.root / f"hr_{shard:05d}.npy", mmap_mode="r"),
+            )
+        return self._shards[shard]
+
+    def read(self, i: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        LR (bands, H, W) and HR (bands, scale * H, scale * W) memmap views of sample `i`.
+        """
+        row = self.index.iloc[i]
+        lr, hr = self.shard(int(row["shard"]))
+        return lr[int(row["position"])], hr[int(row["position"])]
+
+    def read_window(
+            self,
+            i: int,
+            col_off: int,
+            row_off: int,
+            width: int,
+            height: int
+        ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Aligned LR/HR crop views of sample `i` (offsets and size in LR pixels).
+        """
+        lr, hr = self.read(i)
+        s = self.scale
+        return (
+            lr[:, row_off:row_off + height, col_off:col_off + width],
+            hr[:, s * row_off:s * (row_off + height), s * col_off:s * (col_off + width)],
+        )
@@ -6,6 +6,7 @@ import tacoreader
 import rasterio as rio
 import datetime
 import ee
+from utils import *
 
 # Authenticate and initialize Google Earth Engine
 ee.Authenticate()
@@ -28,64 +29,25 @@ table["tortilla_path"] = (
 
 # table.to_csv("tables/neon_s2_all_2_images_pairs_updated.csv", index=False)
 
-# Iterate over rows of the metadata table to process each image
-for i, row in table.iterrows():
-    
-    # Print progress every 100 rows
-    if i % 100 == 0:
-        print(f"Processing {i}/{len(table)}")
-
-    # Load profiles and metadata for the low-resolution (LR) image
-    profile_lr = rio.open(row["s2_root_path"]).profile
-    sample_lr = tacotoolbox.tortilla.datamodel.Sample(
-        id="lr",
-        path=row["s2_root_path"],
-        file_format="GTiff",
-        data_split="train",
-        stac_data={
-            "crs": "EPSG:" + str(profile_lr["crs"].to_epsg()),
-            "geotransform": profile_lr["transform"].to_gdal(),
-            "raster_shape": (profile_lr["height"], profile_lr["width"]),
-            "time_start": datetime.datetime.strptime(row.s2_date, '%Y-%m-%d'),
-            "time_end": datetime.datetime.strptime(row.s2_date, '%Y-%m-%d'),
-            "centroid": f"POINT ({row['lon_c']} {row['lat_c']})"
-        },
-        s2_id_gee=row["s2_id_gee"],
-        cloud_perc=((1 - row["cs_cdf"]) * 100)
-    )
-
-    # Load profiles and metadata for the high-resolution (HR) image
-    profile_hr = rio.open(row["neon_root_path"]).profile
-    sample_hr = tacotoolbox.tortilla.datamodel.Sample(
-        id="hr",
-        path=row["neon_root_path"],
-        file_format="GTiff",
-        data_split="train",
-        stac_data={
-            "crs": "EPSG:" + str(profile_hr["crs"].to_epsg()),
-            "geotransform": profile_hr["transform"].to_gdal(),
-            "raster_shape": (profile_hr["height"], profile_hr["width"]),
-            "time_start": datetime.datetime.strptime(row.neon_date, '%Y-%m-%d'), 
-            "time_end": datetime.datetime.strptime(row.neon_date, '%Y-%m-%d'), 
-            "centroid": f"POINT ({row['lon_c']} {row['lat_c']})"
-        },
-        s2_id_gee = row["neon_id_gee"],
-        neon_val_null = row["neon_val_null"]
-    )
-
-    # Create a set of samples for each image type (LR, HR, mask, harmonized LR and HR)
-    samples = tacotoolbox.tortilla.datamodel.Samples(
-        samples=[
-            sample_lr,
-            sample_hr
-        ]
-    )
+# Create one tortilla per row in parallel; up-to-date tortillas are skipped
+TORTILLA_WORKERS = 16
+status, tortilla_metadata = build_tortillas(
+    table,
+    workers=TORTILLA_WORKERS,
+    metadata_path=ROOT_DIR / "tortillas_metadata.parquet",
+    metadata_cache="tables/raster_metadata.sqlite"  # filled by geotiff.py
+)
+print(status)
 
-    # Create the tortilla (data object) for this row
-    tacotoolbox.tortilla.create(samples, row["tortilla_path"], quiet=True)
+# Rows whose tortilla failed have no metadata: report and leave them out
+failed = ~table["tortilla_path"].isin(tortilla_metadata.index)
+if failed.any():
+    print(f"{failed.sum()} tortillas failed and are skipped:")
+    print(table.loc[failed, "tortilla_path"].to_string())
+table = table[~failed]
 
 # Process tortilla files and append corresponding metadata
-sample_tortillas = []
+sample_tortillas = {}
 
 for index, row in table.iterrows():
     
@@ -93,9 +55,8 @@ for index, row in table.iterrows():
     if index % 100 == 0:
         print(f"Processing {index}/{len(table)}")
 
-    # Load tortilla data for each row
-    sample_data = tacoreader.load(row["tortilla_path"])
-    sample_data = sample_data.iloc[1]
+    # STAC fields returned by the tortilla build step (no need to reload the tortilla)
+    sample_data = tortilla_metadata.loc[row["tortilla_path"]]
 
     # Create a sample for the tortilla data
     sample_tortilla = tacotoolbox.tortilla.datamodel.Sample(
@@ -103,29 +64,31 @@ for index, row in table.iterrows():
         path=row["tortilla_path"],
         file_format="TORTILLA",
         stac_data={
-            "crs": sample_data["stac:crs"],
-            "geotransform": sample_data["stac:geotransform"],
-            "raster_shape": sample_data["stac:raster_shape"],
-            "centroid": sample_data["stac:centroid"],
-            "time_start": sample_data["stac:time_start"],
-            "time_end": sample_data["stac:time_end"],
+            "crs": sample_data["crs"],
+            "geotransform": tuple(float(v) for v in sample_data["geotransform"]),
+            "raster_shape": tuple(int(v) for v in sample_data["raster_shape"]),
+            "centroid": sample_data["centroid"],
+            "time_start": sample_data["time_start"],
+            "time_end": sample_data["time_end"],
         },
         days_diff=row["abs_days_diff"],
         neon_val_null = row["neon_val_null"]
     )    
-    sample_tortillas.append(sample_tortilla)
-
-# Create a collection of all tortilla samples
-samples = tacotoolbox.tortilla.datamodel.Samples(
-    samples=sample_tortillas
-)
-
-# Add RAI metadata to footer (used for further data processing)
-samples_obj = samples.include_rai_metadata(
-    sample_footprint=5160, # extension in meters
-    cache=False,  # Set to True for caching
-    quiet=False  # Set to True to suppress the progress bar
+    sample_tortillas[row["tortilla_path"]] = sample_tortilla
+
+# Split the tortillas into parts of near-equal size, keeping each folder (site)
+# together; the manifest records which tortilla goes to which part
+PART_SIZE = 5 * 1024**3
+GROUP_BY_FOLDER = True
+# Sizes come from the build step metadata, only for the tortillas that were built
+tortilla_sizes = tortilla_metadata.loc[table["tortilla_path"], "tortilla_size"]
+parts = plan_taco_parts(
+    tortilla_sizes,
+    target_bytes=PART_SIZE,
+    groups=table.set_index("tortilla_path")["folder"] if GROUP_BY_FOLDER else None
 )
+parts.to_csv(ROOT_DIR / "tacos_parts_manifest.csv", index=False)
+print(parts.groupby("part")["size"].agg(["count", "sum"]))
 
 
 description = """
@@ -253,11 +216,30 @@ collection_object = tacotoolbox.datamodel.Collection(
 # Get the path of the tortilla file and create the directory if needed
 full_path = table["tortilla_path"].iloc[0]
 directory = pathlib.Path(full_path).parent.parent / "tacos"
+directory.mkdir(parents=True, exist_ok=True)
 
+# Remove the tacos of previous runs (single taco or parts), otherwise stale
+# parts beyond the new part count would survive and be uploaded
+for stale in directory.glob("sen2neon*.taco"):
+    stale.unlink()
+
+# Generate one taco per part using the samples and collection objects
+for part, part_table in parts.groupby("part"):
+
+    # Create a collection of the tortilla samples of the part
+    samples = tacotoolbox.tortilla.datamodel.Samples(
+        samples=[sample_tortillas[path] for path in part_table["tortilla_path"]]
+    )
+
+    # Add RAI metadata to footer (used for further data processing)
+    samples_obj = samples.include_rai_metadata(
+        sample_footprint=5160, # extension in meters
+        cache=False,  # Set to True for caching
+        quiet=False  # Set to True to suppress the progress bar
+    )
 
-# Generate the final output file using the samples and collection objects
-output_file = tacotoolbox.create(
-    samples=samples_obj,
-    collection=collection_object,
-    output= directory / "sen2neon.taco"
-)
\ No newline at end of file
+    output_file = tacotoolbox.create(
+        samples=samples_obj,
+        collection=collection_object,
+        output=directory / f"sen2neon.{part:04d}.part.taco"
+    )
\ No newline at end of file
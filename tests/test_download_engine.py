@@ -0,0 +1,99 @@
+"""
+DownloadEngine driven by local fakes of the graph build and computePixels.
+"""
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("ee")
+pytest.importorskip("osgeo")
+utils = pytest.importorskip("utils")
+
+
+class FakeComputePixels:
+    """Sleeps and returns bytes; records concurrency, timing and scripted errors."""
+
+    def __init__(self, delay=0.02, errors=None):
+        self.delay = delay
+        self.errors = dict(errors or {})  # outname -> exception raised once
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.intervals = []  # (outname, start, end)
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, request, outname):
+        with self._lock:
+            self.calls.append(outname)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            error = self.errors.pop(outname, None)
+        start = time.perf_counter()
+        try:
+            time.sleep(self.delay)
+            if error is not None:
+                raise error
+            return b"\x00" * 16
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.intervals.append((outname, start, time.perf_counter()))
+
+
+class FakeBuild:
+    """Graph construction of a row: sleeps and returns `tiles` (request, outname) pairs."""
+
+    def __init__(self, tiles=6, delay=0.03):
+        self.tiles = tiles
+        self.delay = delay
+        self.intervals = {}  # row -> (start, end)
+
+    def __call__(self, row):
+        start = time.perf_counter()
+        time.sleep(self.delay)
+        self.intervals[row["row"]] = (start, time.perf_counter())
+        return [({"row": row["row"]}, f"{row['row']}_{n}") for n in range(self.tiles)]
+
+
+def table(n_rows):
+    return pd.DataFrame({"row": range(n_rows)})
+
+
+def test_in_flight_never_exceeds_the_limit():
+    fetch = FakeComputePixels()
+    engine = utils.DownloadEngine(FakeBuild(tiles=8), fetch=fetch, max_in_flight=3)
+    stats = engine.run(table(5))
+    assert stats["rows"] == 5 and stats["tiles"] == 40
+    assert fetch.max_in_flight == 3
+
+
+def test_graph_building_overlaps_fetching():
+    fetch = FakeComputePixels(delay=0.05)
+    build = FakeBuild(tiles=4, delay=0.03)
+    utils.DownloadEngine(build, fetch=fetch, max_in_flight=2, build_workers=1, build_ahead=3).run(table(4))
+
+    # Some row is built while tiles of another row are being fetched
+    overlaps = [
+        (row, outname)
+        for row, (b_start, b_end) in build.intervals.items()
+        for outname, f_start, f_end in fetch.intervals
+        if not outname.startswith(f"{row}_") and f_start < b_end and b_start < f_end
+    ]
+    assert overlaps
+
+
+def test_non_fatal_failures_are_requeued():
+    fetch = FakeComputePixels(errors={
+        "1_2": Exception("Computation timed out."),
+        "2_0": Exception("Image.load: Image asset 'x' not found."),
+    })
+    engine = utils.DownloadEngine(FakeBuild(tiles=3), fetch=fetch, max_in_flight=4)
+    stats = engine.run(table(3))
+
+    assert stats["errors"] == 2 and stats["requeued"] == 1
+    # The transient tile is fetched twice and succeeds, the fatal one only once
+    assert fetch.calls.count("1_2") == 2 and fetch.calls.count("2_0") == 1
+    assert stats["tiles"] == 8
+    assert engine.failed == []
@@ -0,0 +1,109 @@
+"""
+Bulk metadata prefetch against a stubbed `ee.data.computeValue`.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+ee = pytest.importorskip("ee")
+pytest.importorskip("osgeo")
+utils = pytest.importorskip("utils")
+
+
+# Asset properties served by the stub
+PROPERTIES = {
+    **{f"s2_{i}": {"SPACECRAFT_NAME": f"Sentinel-2{'AB'[i % 2]}"} for i in range(1200)},
+    **{
+        f"neon_{i}": {
+            f"WL_FWHM_{band}": f"{381.5 + 5.008 * k + i / 3},5.8"
+            for k, band in enumerate(utils.NEON_BANDS)
+        }
+        for i in range(3)
+    },
+}
+
+
+class FakeImage:
+    def __init__(self, asset_id):
+        self.asset_id = asset_id
+
+    def get(self, name):
+        return ("property", self.asset_id, name)
+
+    def toDictionary(self, names):
+        return FakeDictionary(self.asset_id, names)
+
+
+class FakeDictionary:
+    def __init__(self, asset_id, names):
+        self.asset_id = asset_id
+        self.names = names
+        self.extra = {}
+
+    def set(self, key, value):
+        self.extra[key] = value
+        return self
+
+
+def evaluate(properties):
+    if isinstance(properties, FakeDictionary):
+        values = {name: PROPERTIES[properties.asset_id][name] for name in properties.names}
+        return {**values, **properties.extra}
+    return {
+        key: PROPERTIES[value[1]][value[2]] if isinstance(value, tuple) else value
+        for key, value in properties.items()
+    }
+
+
+@pytest.fixture
+def compute_value(monkeypatch):
+    """Replaces the ee client: images and features stay local, computeValue evaluates them."""
+    calls = []
+
+    def computeValue(collection):
+        calls.append(len(collection))
+        return {"features": [{"properties": evaluate(properties)} for properties in collection]}
+
+    monkeypatch.setattr(ee, "Image", FakeImage, raising=False)
+    monkeypatch.setattr(ee, "Feature", lambda geometry, properties: properties, raising=False)
+    monkeypatch.setattr(ee, "FeatureCollection", list, raising=False)
+    monkeypatch.setattr(ee.data, "computeValue", computeValue, raising=False)
+    return calls
+
+
+def test_fetch_spacecraft_names(compute_value):
+    ids = [f"s2_{i}" for i in range(1200)]
+    names = utils.fetch_spacecraft_names(ids, chunk_size=500)
+    assert compute_value == [500, 500, 200]
+    assert names == {s2_id: PROPERTIES[s2_id]["SPACECRAFT_NAME"] for s2_id in ids}
+
+
+def test_fetch_neon_wavelengths(compute_value):
+    wavelengths = utils.fetch_neon_wavelengths(["neon_0", "neon_1", "neon_2"], chunk_size=2)
+    assert compute_value == [2, 1]
+    for i in range(3):
+        expected = [381.5 + 5.008 * k + i / 3 for k in range(len(utils.NEON_BANDS))]
+        np.testing.assert_array_equal(wavelengths[f"neon_{i}"], expected)
+
+
+def test_wavelengths_to_str_round_trips():
+    wavelengths = np.random.default_rng(0).uniform(380, 2510, 426)
+    restored = utils.wavelengths_from_str(utils.wavelengths_to_str(wavelengths))
+    np.testing.assert_array_equal(restored, wavelengths)
+
+
+def test_prefetched_columns_survive_the_csv(compute_value, tmp_path):
+    table = pd.DataFrame({
+        "s2_id_gee": ["s2_0", "s2_1", "s2_0"],
+        "neon_id_gee": ["neon_0", "neon_1", "neon_0"],
+    })
+    table = utils.prefetch_pair_metadata(table)
+    # One request per kind, duplicated ids requested once
+    assert compute_value == [2, 2]
+    assert table["s2_spacecraft"].tolist() == ["Sentinel-2A", "Sentinel-2B", "Sentinel-2A"]
+
+    table.to_csv(tmp_path / "pairs.csv", index=False)
+    restored = utils.prefetch_pair_metadata(pd.read_csv(tmp_path / "pairs.csv"))
+    assert compute_value == [2, 2]  # nothing requested again
+    expected = utils.fetch_neon_wavelengths(["neon_1"])
+    np.testing.assert_array_equal(utils.wavelengths_from_str(restored["neon_wavelengths"][1]), expected["neon_1"])
@@ -0,0 +1,118 @@
+"""
+publish_to_hub against a local mock of the HfApi surface it uses.
+"""
+import hashlib
+import types
+
+import pytest
+
+pytest.importorskip("huggingface_hub")
+pytest.importorskip("ee")
+pytest.importorskip("osgeo")
+utils = pytest.importorskip("utils")
+from huggingface_hub.lfs import UploadInfo
+
+
+class MockHfApi:
+    """list_repo_tree / preupload_lfs_files / create_commit over an in-memory repo."""
+
+    def __init__(self, files=None, fail=()):
+        self.files = dict(files or {})  # path -> (size, sha256 or None)
+        self.fail = set(fail)
+        self.preuploaded = []
+        self.commits = []
+
+    def list_repo_tree(self, repo_id, repo_type, recursive):
+        items = [types.SimpleNamespace(path="folder")]
+        for path, (size, sha256) in self.files.items():
+            lfs = None if sha256 is None else types.SimpleNamespace(sha256=sha256)
+            items.append(types.SimpleNamespace(path=path, size=size, lfs=lfs))
+        return items
+
+    def preupload_lfs_files(self, repo_id, additions, repo_type):
+        # Like the real one: operations already uploaded are skipped
+        for op in additions:
+            if op._is_uploaded:
+                continue
+            if op.path_in_repo in self.fail:
+                self.fail.discard(op.path_in_repo)
+                raise OSError(f"upload of {op.path_in_repo} interrupted")
+            with open(op.path_or_fileobj, "rb") as src:
+                assert hashlib.sha256(src.read()).digest() == op.upload_info.sha256
+            self.preuploaded.append(op.path_in_repo)
+            op._upload_mode = "lfs"
+            op._is_uploaded = True
+
+    def create_commit(self, repo_id, operations, commit_message, repo_type):
+        additions = [op for op in operations if hasattr(op, "upload_info")]
+        # create_commit pre-uploads whatever is not marked as uploaded yet
+        self.preupload_lfs_files(repo_id, additions, repo_type)
+        self.commits.append(sorted((type(op).__name__, op.path_in_repo) for op in operations))
+        for op in operations:
+            if op in additions:
+                self.files[op.path_in_repo] = (op.upload_info.size, op.upload_info.sha256.hex())
+            else:
+                self.files.pop(op.path_in_repo)
+
+
+@pytest.fixture
+def parts(tmp_path):
+    files = {}
+    for k in range(3):
+        path = tmp_path / f"sen2neon.{k:04d}.part.taco"
+        path.write_bytes(bytes([k]) * (1000 + k))
+        files[path.name] = path
+    return files
+
+
+@pytest.fixture
+def no_rehash(monkeypatch):
+    """Fails if a CommitOperationAdd hashes its file."""
+    def from_path(path):
+        raise AssertionError(f"{path} hashed again")
+    monkeypatch.setattr(UploadInfo, "from_path", from_path)
+
+
+def sha(path):
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def test_single_commit_skips_identical_parts(parts, tmp_path, no_rehash):
+    first = parts["sen2neon.0000.part.taco"]
+    api = MockHfApi({first.name: (first.stat().st_size, sha(first)), "images/a.png": (3, None)})
+    status = utils.publish_to_hub(
+        api, "repo", parts, deletions=["images/a.png", "missing"], journal_path=tmp_path / "j.jsonl"
+    )
+    assert status["skipped"] == 1 and status["uploaded"] == 2 and status["deleted"] == 1
+    assert len(api.commits) == 1
+    assert ("CommitOperationDelete", "images/a.png") in api.commits[0]
+    assert first.name not in dict((p, k) for k, p in api.commits[0])
+    # Each part is pre-uploaded once, by this function and not again by create_commit
+    assert sorted(api.preuploaded) == ["sen2neon.0001.part.taco", "sen2neon.0002.part.taco"]
+    assert api.files["sen2neon.0002.part.taco"][1] == sha(parts["sen2neon.0002.part.taco"])
+
+
+def test_failed_preupload_commits_nothing_and_resumes(parts, tmp_path, no_rehash):
+    api = MockHfApi(fail={"sen2neon.0001.part.taco"})
+    with pytest.raises(RuntimeError):
+        utils.publish_to_hub(api, "repo", parts, journal_path=tmp_path / "j.jsonl")
+    assert api.commits == []
+    done = list(api.preuploaded)
+
+    status = utils.publish_to_hub(api, "repo", parts, journal_path=tmp_path / "j.jsonl")
+    assert status["resumed"] == len(done) and status["uploaded"] == 3
+    # Only the part that failed is pre-uploaded again, also counting create_commit
+    assert api.preuploaded[len(done):] == ["sen2neon.0001.part.taco"]
+    assert len(api.commits) == 1
+
+    # Everything is on the Hub now: nothing to do
+    status = utils.publish_to_hub(api, "repo", parts, journal_path=tmp_path / "j.jsonl")
+    assert status["skipped"] == 3 and len(api.commits) == 1
+
+
+def test_journal_reuses_hashes(parts, tmp_path, monkeypatch, no_rehash):
+    utils.publish_to_hub(MockHfApi(), "repo", parts, journal_path=tmp_path / "j.jsonl")
+    calls = []
+    monkeypatch.setattr(utils, "file_checksum", lambda paths: calls.append(paths) or "x")
+    utils.publish_to_hub(MockHfApi(), "repo", parts, journal_path=tmp_path / "j.jsonl")
+    assert calls == []
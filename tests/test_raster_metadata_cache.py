@@ -0,0 +1,22 @@
+"""
+Keys of the raster metadata sidecar.
+"""
+import pytest
+
+pytest.importorskip("ee")
+pytest.importorskip("osgeo")
+utils = pytest.importorskip("utils")
+
+OLD_ROOT = "/data/databases/legacy/OLD_SEN2NAIP/SuperSR"
+NEW_ROOT = "/data/databases/legacy/OLD_SEN2NEON"
+SAMPLE = "2018_MLBS_3/2018_MLBS_3__04/2018_MLBS_3__04__01.tif"
+
+
+def test_key_is_independent_of_the_data_root():
+    key = utils.RasterMetadataCache.key
+    assert key(f"{OLD_ROOT}/neon/{SAMPLE}") == key(f"{NEW_ROOT}/neon/{SAMPLE}") == f"neon/{SAMPLE}"
+
+
+def test_key_separates_the_sensors():
+    key = utils.RasterMetadataCache.key
+    assert key(f"{NEW_ROOT}/neon/{SAMPLE}") != key(f"{NEW_ROOT}/sentinel2/{SAMPLE}")
@@ -0,0 +1,104 @@
+"""
+Failure-injection tests of the download retry logic against a fake endpoint.
+"""
+import types
+
+import pytest
+
+pytest.importorskip("ee")
+pytest.importorskip("osgeo")
+utils = pytest.importorskip("utils")
+
+
+class FakeEndpoint:
+    """Raises the scripted errors in order, then returns b"ok"."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self, *args):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return b"ok"
+
+
+class HttpError(Exception):
+    """googleapiclient-like error carrying the HTTP status in `resp.status`."""
+
+    def __init__(self, status, message=""):
+        super().__init__(message)
+        self.resp = types.SimpleNamespace(status=status)
+
+
+def scheduler(**kwargs):
+    return utils.RequestScheduler(sleep=lambda seconds: None, **kwargs)
+
+
+@pytest.mark.parametrize("error, kind", [
+    (Exception("Too many concurrent aggregations."), "quota"),
+    (Exception("Quota exceeded for quota metric 'Requests'"), "quota"),
+    (Exception("HttpError 429 when requesting ..."), "quota"),
+    (Exception("An internal error has occurred (request: 1234)."), "transient"),
+    (Exception("Computation timed out."), "transient"),
+    (Exception("<HttpError 503 when requesting ...>"), "transient"),
+    (ConnectionError("Connection reset by peer"), "transient"),
+    (Exception("Total request size (60000000 bytes) must be less than or equal to 50331648 bytes."), "too_large"),
+    # Bare numbers and words inside fatal messages are not retryable
+    (Exception("Grid dimensions 5000 pixels exceed the limit"), "fatal"),
+    (Exception("Image.load: Image asset 'x_500m' not found."), "fatal"),
+    (Exception("User memory limit exceeded, check the timeout of your request"), "fatal"),
+    (Exception("Image.select: Band pattern 'B13' did not match any bands."), "fatal"),
+])
+def test_classify_message(error, kind):
+    assert utils.classify_ee_error(error) == kind
+
+
+@pytest.mark.parametrize("status, kind", [(429, "quota"), (503, "transient"), (500, "transient"), (400, "fatal"), (404, "fatal")])
+def test_classify_status(status, kind):
+    # The status wins over a misleading message
+    assert utils.classify_ee_error(HttpError(status, "connection timeout 500")) == kind
+
+
+def test_transient_errors_are_retried():
+    endpoint = FakeEndpoint(HttpError(503), Exception("Computation timed out."))
+    s = scheduler()
+    assert s.call(endpoint, "request") == b"ok"
+    assert endpoint.calls == 3
+    assert s.stats["retries"] == 2 and s.stats["failures"] == 0
+
+
+def test_quota_errors_shrink_the_limit():
+    endpoint = FakeEndpoint(HttpError(429), HttpError(429))
+    s = scheduler(max_in_flight=8)
+    assert s.call(endpoint) == b"ok"
+    assert s.stats["throttles"] == 2
+    assert int(s.limiter.limit) == 2
+
+
+def test_fatal_errors_are_not_retried():
+    endpoint = FakeEndpoint(Exception("Image.load: Image asset 'x_500m' not found."))
+    s = scheduler()
+    with pytest.raises(Exception, match="not found"):
+        s.call(endpoint)
+    assert endpoint.calls == 1
+    assert s.stats["failures"] == 1
+
+
+def test_too_large_is_raised_for_splitting():
+    endpoint = FakeEndpoint(Exception("Total request size (9 bytes) must be less than or equal to 4 bytes"))
+    s = scheduler()
+    with pytest.raises(Exception):
+        s.call(endpoint)
+    assert endpoint.calls == 1
+    assert s.stats["too_large"] == 1
+
+
+def test_retries_are_bounded():
+    endpoint = FakeEndpoint(*[HttpError(503)] * 10)
+    s = scheduler(max_retries=3)
+    with pytest.raises(HttpError):
+        s.call(endpoint)
+    assert endpoint.calls == 4
+    assert s.limiter.in_flight == 0
@@ -0,0 +1,114 @@
+"""
+screen_null_percent against a local stub of the Earth Engine client.
+"""
+import types
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("ee")
+pytest.importorskip("osgeo")
+utils = pytest.importorskip("utils")
+
+
+class StubClient:
+    """Records reduceRegions / computeValue calls; B001 counts come from `valid`."""
+
+    def __init__(self, valid):
+        self.valid = valid  # row position -> valid pixels out of 100
+        self.reduce_calls = []  # (asset, row positions)
+        self.compute_calls = []  # features per request
+        client = self
+
+        class Geometry:
+            @staticmethod
+            def Point(coords):
+                return Geometry()
+
+            def transform(self, *args):
+                return self
+
+            def buffer(self, distance):
+                return self
+
+            def bounds(self):
+                return self
+
+        class Image:
+            def __init__(self, asset=None):
+                self.asset = asset
+
+            @staticmethod
+            def constant(value):
+                return Image()
+
+            def rename(self, name):
+                return self
+
+            def select(self, band):
+                return self
+
+            def addBands(self, other):
+                return Image(other.asset)
+
+            def reduceRegions(self, collection, reducer, scale):
+                rows = [feature["row"] for feature in collection.items]
+                client.reduce_calls.append((self.asset, rows))
+                return FeatureCollection([
+                    {"row": row, "constant": 100, "B001": client.valid[row]} for row in rows
+                ])
+
+        class FeatureCollection:
+            def __init__(self, items):
+                self.items = list(items)
+
+            def flatten(self):
+                return FeatureCollection(ft for fc in self.items for ft in fc.items)
+
+            def select(self, *args):
+                return self
+
+        def computeValue(collection):
+            client.compute_calls.append(len(collection.items))
+            return {"features": [{"properties": props} for props in collection.items]}
+
+        self.Geometry = Geometry
+        self.Image = Image
+        self.FeatureCollection = FeatureCollection
+        self.Feature = lambda geometry, properties: properties
+        self.Reducer = types.SimpleNamespace(count=lambda: "count")
+        self.data = types.SimpleNamespace(computeValue=computeValue)
+
+
+def test_one_reduce_per_asset_one_request_per_chunk():
+    table = pd.DataFrame(
+        {
+            "neon_id_gee": ["A", "B", "A", "C", "B"],
+            "lon_c": 0.0,
+            "lat_c": 0.0,
+            "epsg": "EPSG:32617",
+        },
+        index=["r0", "r1", "r2", "r3", "r4"],
+    )
+    client = StubClient(valid={0: 100, 1: 75, 2: 50, 3: 0, 4: 90})
+
+    null_percent = utils.screen_null_percent(table, rows_per_request=3, client=client)
+
+    # Rows grouped per asset, whole assets per request: [A] then [B, C]
+    assert client.reduce_calls == [("A", [0, 2]), ("B", [1, 4]), ("C", [3])]
+    assert client.compute_calls == [2, 3]
+    # The merged counts land on their own rows
+    pd.testing.assert_series_equal(
+        null_percent,
+        pd.Series([0.0, 25.0, 50.0, 100.0, 10.0], index=table.index, name="nullPercent"),
+    )
+
+
+def test_zero_pixel_squares_are_nan():
+    table = pd.DataFrame({"neon_id_gee": ["A"], "lon_c": [0.0], "lat_c": [0.0], "epsg": ["EPSG:32617"]})
+    client = StubClient(valid={0: 0})
+    client.Image.reduceRegions = lambda self, collection, reducer, scale: client.FeatureCollection(
+        [{"row": 0, "constant": 0, "B001": 0}]
+    )
+    assert np.isnan(utils.screen_null_percent(table, client=client).iloc[0])
@@ -0,0 +1,47 @@
+"""
+TilePlanner grids for the 2.5 m (2064 px) and 1 m (5160 px) downloads.
+"""
+import pytest
+
+pytest.importorskip("ee")
+pytest.importorskip("osgeo")
+utils = pytest.importorskip("utils")
+
+
+def planner(size, align=256, n_bands=12):
+    return utils.TilePlanner(width=size, height=size, n_bands=n_bands, dtype="float64", align=align)
+
+
+def covers(windows, size):
+    return sum(w * h for _, _, w, h in windows) == size * size
+
+
+@pytest.mark.parametrize("size, align, n_tiles", [
+    (2064, 1, 9),
+    (2064, 256, 12),  # 16-px remainder folded: 3 x 4 instead of 3 x 5
+    (5160, 1, 54),
+    (5160, 256, 63),  # 40-px rows cannot be folded into 1792 x 256 cells within the limit
+])
+def test_tile_count(size, align, n_tiles):
+    tiles = planner(size, align)
+    windows = tiles.windows()
+    assert len(windows) == n_tiles
+    assert covers(windows, size)
+    assert max(w * h for _, _, w, h in windows) <= tiles.max_pixels
+
+
+def test_remainders_below_align_are_folded():
+    windows = planner(2064).windows()
+    assert min(min(w, h) for _, _, w, h in windows) >= 256
+    # Every window starts on a block boundary
+    assert all(col % 256 == 0 and row % 256 == 0 for col, row, _, _ in windows)
+
+
+def test_remainder_kept_when_folding_exceeds_the_limit():
+    tiles = planner(5160)
+    cell_w, cell_h = tiles.grid()
+    assert (cell_w, cell_h) == (1792, 256)
+    assert cell_w * (cell_h + 40) > tiles.max_pixels
+    assert sorted({h for _, _, _, h in tiles.windows()}) == [40, 256]
+    # With fewer bands the same remainder fits and is folded
+    assert sorted({h for _, _, _, h in planner(5160, n_bands=11).windows()}) == [256, 296]
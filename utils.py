@@ -6,101 +6,1236 @@ import numpy as np
 import math
 import pandas as pd
 from dataclasses import dataclass 
-from osgeo import gdal
+from osgeo import gdal, osr
 import pathlib
+import functools
+import hashlib
+import shutil
+import re
+import copy
+import time
+import threading
+import collections
+import heapq
+import concurrent.futures
+import os
+import json
+import tempfile
+import random
+import datetime
+import sqlite3
 
 
 
-def warp_neon_dir(dir_path):
+# ---------------------------------------------------------------------------------------------
+# GeoTIFF compression profiles
+# block=None keeps the writer's default block size (256 for NEON, 64 for S2).
+COMPRESSION_PROFILES = {
+    # Current default: smallest files, slowest writes
+    "archive": {"codec": "ZSTD", "level": 13, "predictor": 2, "block": None, "interleave": "BAND"},
+    "balanced": {"codec": "ZSTD", "level": 6, "predictor": 2, "block": None, "interleave": "BAND"},
+    "fast-write": {"codec": "ZSTD", "level": 1, "predictor": 2, "block": None, "interleave": "BAND"},
+    # One block holds every band of a window, so a crop decodes fewer blocks
+    "fast-random-read": {"codec": "ZSTD", "level": 3, "predictor": 2, "block": 128, "interleave": "PIXEL"},
+    "deflate": {"codec": "DEFLATE", "level": 6, "predictor": 2, "block": None, "interleave": "BAND"},
+    "lzw": {"codec": "LZW", "level": None, "predictor": 2, "block": None, "interleave": "BAND"},
+    # Lossless LERC (MAX_Z_ERROR=0) followed by ZSTD
+    "lerc": {"codec": "LERC_ZSTD", "level": 9, "predictor": None, "block": None, "interleave": "BAND"},
+}
+
+
+def creation_options(profile: str = "archive", block_size: int = 256, num_threads: int = 20) -> list:
+    """
+    Returns the GTiff creation options of a compression profile.
+
+    Args:
+        profile (str, optional): Key of COMPRESSION_PROFILES. Defaults to "archive".
+        block_size (int, optional): Block size when the profile does not set one. Defaults to 256.
+        num_threads (int, optional): Compression threads. Defaults to 20.
+
+    Returns:
+        list: Options for gdal.Warp/gdal.Translate/Create.
+    """
+    if profile not in COMPRESSION_PROFILES:
+        raise ValueError(f"Unknown compression profile: {profile}")
+    config = COMPRESSION_PROFILES[profile]
+    block = config["block"] or block_size
+
+    options = [
+        "TILED=YES",
+        f"BLOCKXSIZE={block}",
+        f"BLOCKYSIZE={block}",
+        f"COMPRESS={config['codec']}",
+    ]
+    if config["codec"] == "ZSTD" or config["codec"] == "LERC_ZSTD":
+        options.append(f"ZSTD_LEVEL={config['level']}")
+    elif config["codec"] == "DEFLATE":
+        options.append(f"ZLEVEL={config['level']}")
+    if config["codec"].startswith("LERC"):
+        options.append("MAX_Z_ERROR=0")
+    if config["predictor"] is not None:
+        options.append(f"PREDICTOR={config['predictor']}")
+    options += [f"NUM_THREADS={num_threads}", f"INTERLEAVE={config['interleave']}"]
+    return options
+
+
+def cog_creation_options(
+        profile: str = "archive",
+        block_size: int = 256,
+        num_threads: int = 20,
+        overview_resampling: str = "AVERAGE"
+    ) -> list:
+    """
+    Returns the COG driver options of a compression profile. Internal overviews
+    are built with `overview_resampling` using `num_threads` threads.
+    """
+    config = COMPRESSION_PROFILES[profile]
+    options = [
+        f"BLOCKSIZE={config['block'] or block_size}",
+        f"COMPRESS={config['codec']}",
+        f"NUM_THREADS={num_threads}",
+        f"OVERVIEW_RESAMPLING={overview_resampling}",
+        f"INTERLEAVE={config['interleave']}",  # GDAL >= 3.11, ignored before
+        "BIGTIFF=IF_SAFER",
+    ]
+    if config["level"] is not None:
+        options.append(f"LEVEL={config['level']}")
+    if config["codec"].startswith("LERC"):
+        options.append("MAX_Z_ERROR=0")
+    if config["predictor"] is not None:
+        options.append("PREDICTOR=STANDARD")
+    return options
+
+
+def output_format(
+        profile: str,
+        block_size: int,
+        num_threads: int,
+        cog: bool = False,
+        overview_resampling: str = "AVERAGE"
+    ) -> Tuple[str, list]:
+    """
+    Returns (driver, creation options): tiled GTiff, or COG with overviews.
+    """
+    if cog:
+        return "COG", cog_creation_options(profile, block_size, num_threads, overview_resampling)
+    return "GTiff", creation_options(profile, block_size, num_threads)
+
+
+def tiles_grid_aligned(input_files: list, tolerance: float = 1e-6) -> bool:
+    """
+    Checks whether rasters share CRS and pixel size, have no rotation and sit on
+    the same pixel grid (offsets are whole pixels), so they can be mosaicked
+    without resampling.
+    """
+    reference = None
+    for f in input_files:
+        ds = gdal.Open(str(f))
+        gt, wkt = ds.GetGeoTransform(), ds.GetProjection()
+        ds = None
+
+        if gt[2] != 0 or gt[4] != 0:
+            return False
+        if reference is None:
+            reference = (gt, osr.SpatialReference(wkt=wkt))
+            continue
+
+        ref_gt, ref_srs = reference
+        if not ref_srs.IsSame(osr.SpatialReference(wkt=wkt)):
+            return False
+        if abs(gt[1] - ref_gt[1]) > tolerance * abs(ref_gt[1]) or abs(gt[5] - ref_gt[5]) > tolerance * abs(ref_gt[5]):
+            return False
+        for offset in [(gt[0] - ref_gt[0]) / ref_gt[1], (gt[3] - ref_gt[3]) / ref_gt[5]]:
+            if abs(offset - round(offset)) > 1e-3:
+                return False
+    return reference is not None
+
+
+def _warp(output_file, input_files: list, driver: str, options: list, **warp_kwargs) -> None:
+    """
+    gdal.Warp into a GTiff, or, for COG (a copy-only driver), into a virtual
+    warped dataset that is then copied with the COG options.
+    """
+    if driver != "COG":
+        warp_options = gdal.WarpOptions(format='GTiff', creationOptions=options, **warp_kwargs)
+        gdal.Warp(
+            destNameOrDestDS=str(output_file),
+            srcDSOrSrcDSTab=input_files,
+            options=warp_options
+        )
+        return
+
+    warped = gdal.Warp("", input_files, options=gdal.WarpOptions(format="VRT", **warp_kwargs))
+    gdal.Translate(str(output_file), warped, format="COG", creationOptions=options)
+    warped = None
+
+
+def warp_neon_dir(
+        dir_path,
+        num_threads=20,
+        mode="auto",
+        profile="archive",
+        cog=False,
+        overview_resampling="AVERAGE",
+        metadata_cache=None
+    ):
     """
     Recibe un objeto pathlib.Path (o algo convertible a Path),
     busca los .tif en ese directorio y los une en un archivo .tif
     de salida con las opciones deseadas.
+
+    mode:
+        "auto": if the tiles are grid-aligned (`tiles_grid_aligned`) they are
+                mosaicked with a VRT + block copy (gdal.Translate), otherwise
+                with gdal.Warp.
+        "warp": always gdal.Warp.
+        "vrt":  only writes <dir>.vrt (no copy) and returns it.
+
+    profile: compression profile (see COMPRESSION_PROFILES).
+    cog: writes a Cloud-Optimized GeoTIFF with internal overviews
+         (`overview_resampling`), built with `num_threads` threads.
+    metadata_cache: `RasterMetadataCache` sidecar filled with the profile and
+         band statistics of the output .tif.
     """
 
     dir_path = pathlib.Path(dir_path)
-    input_files = list(dir_path.glob("*.tif"))
-    output_file = dir_path.with_suffix(".tif")
+    input_files = sorted(dir_path.glob("*.tif"))
+    output_file = dir_path.with_suffix(".vrt" if mode == "vrt" else ".tif")
+
+    driver, options = output_format(profile, 256, num_threads, cog, overview_resampling)
 
     if output_file.exists():
         print(f"{output_file} exists")
+        if output_file.suffix == ".tif":
+            record_raster_metadata(output_file, metadata_cache)
         return output_file.as_posix()
-    else:
-        warp_options = gdal.WarpOptions(
-            format='GTiff',
-            outputType=gdal.GDT_UInt16,
+
+    if mode != "warp" and tiles_grid_aligned(input_files):
+        vrt_file = dir_path.with_suffix(".vrt")
+        vrt = gdal.BuildVRT(
+            vrt_file.as_posix(),
+            [str(f) for f in input_files],
             srcNodata=0,         # Nodata de entrada
-            dstNodata=65535,     # Nodata de salida
-            creationOptions=[
-                "TILED=YES",
-                "BLOCKXSIZE=256",
-                "BLOCKYSIZE=256",
-                "COMPRESS=ZSTD",
-                "ZSTD_LEVEL=13",
-                "PREDICTOR=2",
-                "NUM_THREADS=20",
-                "INTERLEAVE=BAND"
-            ]
+            VRTNodata=65535      # Nodata de salida
         )
-
-        gdal.Warp(
-            destNameOrDestDS=output_file.as_posix(),
-            srcDSOrSrcDSTab=[str(f) for f in input_files],
-            options=warp_options
+        vrt = None  # flush the .vrt to disk
+        if mode == "vrt":
+            return vrt_file.as_posix()
+
+        gdal.Translate(
+            output_file.as_posix(),
+            vrt_file.as_posix(),
+            format=driver,
+            outputType=gdal.GDT_UInt16,
+            noData=65535,
+            creationOptions=options
         )
-        
-        return output_file 
+        vrt_file.unlink()
+        record_raster_metadata(output_file, metadata_cache)
+        return output_file.as_posix()
+
+    if mode == "vrt":
+        raise ValueError(f"Tiles in {dir_path} are not grid-aligned; a VRT would need resampling.")
+
+    warp_kwargs = dict(
+        outputType=gdal.GDT_UInt16,
+        multithread=num_threads > 1,
+        srcNodata=0,         # Nodata de entrada
+        dstNodata=65535,     # Nodata de salida
+    )
+    _warp(output_file, [str(f) for f in input_files], driver, options, **warp_kwargs)
+    record_raster_metadata(output_file, metadata_cache)
+
+    return output_file.as_posix()
     
 
-def warp_single_tif(input_tif, output_tif):
+def warp_single_tif(
+        input_tif,
+        output_tif,
+        num_threads=20,
+        mode="auto",
+        profile="archive",
+        cog=False,
+        overview_resampling="AVERAGE",
+        metadata_cache=None
+    ):
+    """
+    Recompresses a single S2 GeoTIFF. In "auto" mode it is a block copy
+    (gdal.Translate) unless the input declares its own nodata value, which
+    needs gdal.Warp to be remapped to 65535. `profile` selects the
+    compression (see COMPRESSION_PROFILES); with `cog` the output is a
+    Cloud-Optimized GeoTIFF with internal overviews. The output is recorded
+    in `metadata_cache` (a `RasterMetadataCache` sidecar) when given.
+    """
 
     input_tif = pathlib.Path(input_tif)
     output_tif = pathlib.Path(output_tif)
 
     output_tif.parent.mkdir(parents=True, exist_ok=True)
 
+    driver, options = output_format(profile, 64, num_threads, cog, overview_resampling)
+
     if output_tif.exists():
         print(f"{output_tif} ya existe.")
-
+        record_raster_metadata(output_tif, metadata_cache)
+        return output_tif.as_posix()
+
+    ds = gdal.Open(str(input_tif))
+    has_nodata = ds.GetRasterBand(1).GetNoDataValue() is not None
+    ds = None
+
+    if mode != "warp" and not has_nodata:
+        gdal.Translate(
+            str(output_tif),
+            str(input_tif),
+            format=driver,
+            outputType=gdal.GDT_UInt16,
+            noData=65535,
+            creationOptions=options
+        )
     else:
-        warp_options = gdal.WarpOptions(
-            format='GTiff',
+        warp_kwargs = dict(
             outputType=gdal.GDT_UInt16,
+            multithread=num_threads > 1,
             dstNodata=65535,
-            creationOptions=[
-                "TILED=YES",
-                "BLOCKXSIZE=64",
-                "BLOCKYSIZE=64",
-                "COMPRESS=ZSTD",
-                "ZSTD_LEVEL=13",
-                "PREDICTOR=2",
-                "NUM_THREADS=20",
-                "INTERLEAVE=BAND"
-            ]
-        )
-
-        gdal.Warp(
-            destNameOrDestDS=str(output_tif),
-            srcDSOrSrcDSTab=[str(input_tif)],
-            options=warp_options
         )
+        _warp(output_tif, [str(input_tif)], driver, options, **warp_kwargs)
 
-        print(f"{output_tif} generado.")
+    record_raster_metadata(output_tif, metadata_cache)
+    print(f"{output_tif} generado.")
+    return output_tif.as_posix()
         
 
 
 
+# ---------------------------------------------------------------------------------------------
+# Compression benchmark
+def benchmark_compression(
+        paths: list,
+        profiles: list = None,
+        block_size: int = 256,
+        window: int = 256,
+        n_reads: int = 50,
+        num_threads: int = 20,
+        tmp_dir: str = None,
+        seed: int = 0
+    ) -> pd.DataFrame:
+    """
+    Rewrites sample rasters with each compression profile and measures write
+    throughput, file size and windowed-read latency (all bands, random window,
+    fresh dataset per read so blocks are decoded every time).
+
+    Args:
+        paths (list): Sample GeoTIFFs (e.g. some 'neon_root_path' values).
+        profiles (list, optional): Profiles to test. Defaults to all COMPRESSION_PROFILES.
+        block_size (int, optional): Default block size of the profiles. Defaults to 256.
+        window (int, optional): Side of the read window in pixels. Defaults to 256.
+        n_reads (int, optional): Random windows read per file. Defaults to 50.
+        num_threads (int, optional): Compression threads. Defaults to 20.
+        tmp_dir (str, optional): Where the rewritten files go. Defaults to a temporary directory.
+        seed (int, optional): Seed of the read windows. Defaults to 0.
+
+    Returns:
+        pd.DataFrame: One row per (path, profile).
+    """
+    profiles = list(COMPRESSION_PROFILES) if profiles is None else profiles
+    rng = np.random.default_rng(seed)
+    records = []
+
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as workdir:
+        for path in paths:
+            src = gdal.Open(str(path))
+            width, height, n_bands = src.RasterXSize, src.RasterYSize, src.RasterCount
+            raw_bytes = width * height * n_bands * gdal.GetDataTypeSize(src.GetRasterBand(1).DataType) // 8
+            src = None
+
+            size = min(window, width, height)
+            offsets = [
+                (int(rng.integers(0, width - size + 1)), int(rng.integers(0, height - size + 1)))
+                for _ in range(n_reads)
+            ]
+
+            for profile in profiles:
+                out = pathlib.Path(workdir) / f"{profile}.tif"
+
+                start = time.perf_counter()
+                gdal.Translate(
+                    out.as_posix(), str(path), format="GTiff",
+                    creationOptions=creation_options(profile, block_size, num_threads)
+                )
+                write_s = time.perf_counter() - start
+
+                latencies = []
+                for xoff, yoff in offsets:
+                    start = time.perf_counter()
+                    ds = gdal.Open(out.as_posix())
+                    ds.ReadAsArray(xoff, yoff, size, size)
+                    ds = None
+                    latencies.append(time.perf_counter() - start)
+
+                file_bytes = out.stat().st_size
+                records.append({
+                    "path": str(path),
+                    "profile": profile,
+                    "write_s": write_s,
+                    "write_mb_s": raw_bytes / 1e6 / write_s,
+                    "size_mb": file_bytes / 1e6,
+                    "ratio": raw_bytes / file_bytes,
+                    "read_ms_mean": 1000 * float(np.mean(latencies)),
+                    "read_ms_p95": 1000 * float(np.percentile(latencies, 95)),
+                })
+                out.unlink()
+
+    return pd.DataFrame(records)
+
+
+# ---------------------------------------------------------------------------------------------
+# Parallel mosaicking (warp_neon_dir / warp_single_tif over the whole table)
+def _init_gdal_worker(cachemax_mb: int, num_threads: int) -> None:
+    gdal.SetCacheMax(cachemax_mb * 1024 * 1024)
+    gdal.SetConfigOption("GDAL_NUM_THREADS", str(num_threads))
+
+
+def _run_timed(func: Callable, args: tuple, num_threads: int) -> Tuple[object, float]:
+    start = time.perf_counter()
+    result = func(*args, num_threads=num_threads)
+    return result, time.perf_counter() - start
+
+
+def run_mosaic_batch(
+        func: Callable,
+        args_list: list,
+        workers: int = None,
+        max_cores: int = None,
+        gdal_cachemax_mb: int = 512
+    ) -> list:
+    """
+    Runs `func(*args, num_threads=...)` (e.g. `warp_neon_dir`) for every item of
+    `args_list` in a process pool.
+
+    The cores are split between processes: each worker gets
+    max_cores // workers GDAL threads and its own `gdal_cachemax_mb` block cache,
+    so the total stays within `max_cores` threads and workers * cache memory.
+
+    Args:
+        func (Callable): Function accepting a `num_threads` keyword.
+        args_list (list): One tuple of positional arguments per row.
+        workers (int, optional): Number of processes. Defaults to max_cores // 4.
+        max_cores (int, optional): Total core budget. Defaults to os.cpu_count().
+        gdal_cachemax_mb (int, optional): GDAL_CACHEMAX per worker in MB. Defaults to 512.
+
+    Returns:
+        list: The result of each row, in input order (None for rows that failed).
+    """
+    max_cores = os.cpu_count() if max_cores is None else max_cores
+    workers = max(1, max_cores // 4) if workers is None else workers
+    num_threads = max(1, max_cores // workers)
+
+    results = [None] * len(args_list)
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_gdal_worker,
+        initargs=(gdal_cachemax_mb, num_threads)
+    ) as executor:
+        futures = {
+            executor.submit(_run_timed, func, tuple(args), num_threads): i
+            for i, args in enumerate(args_list)
+        }
+        for n, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            i = futures[future]
+            try:
+                results[i], seconds = future.result()
+                print(f"[{n}/{len(args_list)}] fila {i}: {seconds:.1f} s")
+            except Exception as e:
+                print(f"[{n}/{len(args_list)}] fila {i}: error {e}")
+    return results
+
+
+def write_atomic(full_outname, data: bytes) -> None:
+    """
+    Writes `data` to a temporary file in the same directory and renames it, so
+    `full_outname` is either complete or absent.
+    """
+    full_outname = pathlib.Path(full_outname)
+    fd, tmp_name = tempfile.mkstemp(dir=full_outname.parent, prefix=f".{full_outname.name}.", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as src:
+            src.write(data)
+        os.replace(tmp_name, full_outname)
+    except BaseException:
+        pathlib.Path(tmp_name).unlink(missing_ok=True)
+        raise
+
 def fetch_and_save_get(ulist, full_outname):
-    """Descarga la imagen con computePixels y la guarda en disco."""
+    """Descarga la imagen con getPixels y la guarda en disco."""
     images_bytes = ee.data.getPixels(ulist)
-    with open(full_outname, "wb") as src:
-        src.write(images_bytes)
+    write_atomic(full_outname, images_bytes)
 
 def fetch_and_save(ulist, full_outname):
     """Descarga la imagen con computePixels y la guarda en disco."""
     images_bytes = ee.data.computePixels(ulist)
-    with open(full_outname, "wb") as src:
-        src.write(images_bytes)
+    write_atomic(full_outname, images_bytes)
+
+# ---------------------------------------------------------------------------------------------
+# Tile planning for computePixels/getPixels
+EE_MAX_REQUEST_BYTES = 50331648  # "Total request size ... must be less than or equal to 50331648 bytes"
+
+
+@dataclass
+class TilePlanner:
+    """
+    Splits a pixel grid into subrequests that fit the Earth Engine payload limit.
+
+    The grid is computed up front from the request size, so no failing request is
+    needed. Cells are as large as allowed; the last column/row takes the remainder
+    when the size does not divide evenly (e.g. 2064 or 5160). With `align` > 1 the
+    cell sizes are multiples of `align` (except the remainder edge), and a
+    remainder smaller than `align` is folded into the last column/row while the
+    enlarged tiles still fit, instead of costing a sliver request of its own.
+
+    Example:
+        planner = TilePlanner(width=2064, height=2064, n_bands=12, dtype="float64")
+        subrequests = planner.subrequests(request)
+    """
+    width: int
+    height: int
+    n_bands: int
+    dtype: str = "float64"
+    max_bytes: int = EE_MAX_REQUEST_BYTES
+    safety: float = 0.95
+    align: int = 1
+
+    @property
+    def bytes_per_pixel(self) -> int:
+        return self.n_bands * np.dtype(self.dtype).itemsize
+
+    @classmethod
+    def from_error(cls, request: dict, message: str, align: int = 1) -> "TilePlanner":
+        """
+        Builds a planner from a "Total request size (X bytes) must be less than or
+        equal to Y bytes" error, for requests whose output size is unknown.
+        """
+        match = re.findall(r"\d+", message)
+        if len(match) < 2:
+            raise ValueError(f"Cannot read the request size from: {message}")
+        request_bytes, max_bytes = int(match[0]), int(match[1])
+        width, height = _request_dimensions(request)
+        return cls(
+            width=width,
+            height=height,
+            n_bands=math.ceil(request_bytes / (width * height)),
+            dtype="uint8",
+            max_bytes=max_bytes,
+            align=align
+        )
+
+    def _cell_size(self, n: int, size: int) -> int:
+        cell = math.ceil(size / n)
+        return min(size, self.align * math.ceil(cell / self.align))
+
+    @property
+    def max_pixels(self) -> int:
+        return int(self.max_bytes * self.safety) // self.bytes_per_pixel
+
+    def _spans(self, cell: int, size: int, fold: bool) -> list:
+        """
+        (offset, length) of the cells along one axis; with `fold`, a last cell
+        smaller than `align` is merged into the previous one.
+        """
+        offsets = list(range(0, size, cell))
+        if fold and len(offsets) > 1 and size - offsets[-1] < self.align:
+            offsets.pop()
+        return [(start, end - start) for start, end in zip(offsets, offsets[1:] + [size])]
+
+    def layout(self, cell_w: int, cell_h: int) -> Tuple[list, list]:
+        """
+        Column and row spans of a cell size, folding the remainders smaller than
+        `align` when the largest tile stays within the request limit.
+        """
+        options = []
+        for fold_cols, fold_rows in ((True, True), (True, False), (False, True), (False, False)):
+            cols = self._spans(cell_w, self.width, fold_cols and self.align > 1)
+            rows = self._spans(cell_h, self.height, fold_rows and self.align > 1)
+            if max(w for _, w in cols) * max(h for _, h in rows) <= self.max_pixels:
+                options.append((cols, rows))
+        return min(options, key=lambda option: len(option[0]) * len(option[1]))
+
+    def grid(self) -> Tuple[int, int]:
+        """
+        Returns the cell size (cell_width, cell_height) that gives the fewest tiles.
+        """
+        max_pixels = self.max_pixels
+        if max_pixels < 1:
+            raise ValueError("A single pixel does not fit in the request limit.")
+
+        # Key: (cell not aligned, number of tiles, non-squareness); lowest wins
+        best = None
+        for n_cols in range(1, self.width + 1):
+            cell_w = self._cell_size(n_cols, self.width)
+            cols = math.ceil(self.width / cell_w)
+            if best is not None and cols > best[0][1]:
+                break
+            cell_h = min(max_pixels // cell_w, self.height)
+            if cell_h < 1:
+                continue
+            if self.align > 1 and cell_h >= self.align:
+                cell_h -= cell_h % self.align
+            rows = math.ceil(self.height / cell_h)
+            cell_h = min(cell_h, self._cell_size(rows, self.height))  # balance rows
+            aligned = cell_w % self.align == 0 or cell_w == self.width
+            aligned &= cell_h % self.align == 0 or cell_h == self.height
+            col_spans, row_spans = self.layout(cell_w, cell_h)
+            key = (not aligned, len(col_spans) * len(row_spans), abs(cell_w - cell_h))
+            if best is None or key < best[0]:
+                best = (key, cell_w, cell_h)
+        return best[1], best[2]
+
+    def windows(self) -> list:
+        """
+        Returns the tiles as (col_off, row_off, width, height), row by row.
+        """
+        cols, rows = self.layout(*self.grid())
+        return [
+            (col, row, width, height)
+            for row, height in rows
+            for col, width in cols
+        ]
+
+    def subrequests(self, request: dict) -> list:
+        """
+        Returns one computePixels/getPixels request per window, with its own
+        dimensions and shifted affine transform (same order as `windows`).
+        """
+        return [_window_request(request, window) for window in self.windows()]
+
+
+def _request_dimensions(request: dict) -> Tuple[int, int]:
+    dimensions = request["grid"]["dimensions"]
+    return int(dimensions["width"]), int(dimensions["height"])
+
+
+def _window_request(request: dict, window: tuple) -> dict:
+    col_off, row_off, width, height = window
+    affine = request["grid"]["affineTransform"]
+
+    subrequest = {k: v for k, v in request.items() if k != "grid"}
+    subrequest["grid"] = copy.deepcopy(request["grid"])
+    subrequest["grid"]["dimensions"] = {"width": width, "height": height}
+    subrequest["grid"]["affineTransform"].update({
+        "translateX": affine["translateX"] + col_off * affine["scaleX"] + row_off * affine["shearX"],
+        "translateY": affine["translateY"] + col_off * affine["shearY"] + row_off * affine["scaleY"],
+    })
+    return subrequest
+
+
+def is_too_large_error(error: Exception) -> bool:
+    return "must be less than or equal to" in str(error)
+
+
+def mosaic_pieces(pieces: list, full_outname) -> None:
+    """
+    Mosaics grid-aligned GeoTIFF pieces into `full_outname` (VRT + block copy,
+    written to a temporary name and renamed, like `write_atomic`).
+    """
+    full_outname = pathlib.Path(full_outname)
+    tmp_name = full_outname.with_name(f".{full_outname.name}.tmp")
+    vrt = gdal.BuildVRT("", [str(p) for p in pieces])
+    gdal.Translate(str(tmp_name), vrt, format="GTiff", creationOptions=["BIGTIFF=IF_SAFER"])
+    vrt = None
+    os.replace(tmp_name, full_outname)
+
+
+def fetch_and_save_adaptive(ulist, full_outname, fetch=fetch_and_save):
+    """
+    Downloads a request with `fetch`; if Earth Engine still rejects it as too
+    large, splits it with `TilePlanner.from_error`, downloads the pieces into a
+    temporary directory and mosaics them back into `full_outname`, so later
+    steps (geotiff.py) find the file under its expected name.
+    """
+    try:
+        fetch(ulist, full_outname)
+    except ee.ee_exception.EEException as ee_error:
+        if not is_too_large_error(ee_error):
+            raise
+        full_outname = pathlib.Path(full_outname)
+        pieces_dir = full_outname.with_name(f".{full_outname.stem}_pieces")
+        pieces_dir.mkdir(parents=True, exist_ok=True)
+        planner = TilePlanner.from_error(ulist, str(ee_error))
+        pieces = []
+        for k, subrequest in enumerate(planner.subrequests(ulist)):
+            piece = pieces_dir / f"{k:02d}{full_outname.suffix}"
+            fetch_and_save_adaptive(subrequest, piece, fetch)
+            pieces.append(piece)
+        mosaic_pieces(pieces, full_outname)
+        shutil.rmtree(pieces_dir)
+
+
+# ---------------------------------------------------------------------------------------------
+# Retry / backoff / rate limiting for computePixels and getPixels
+# HTTP status codes and gRPC/Earth Engine status names, read from the exception itself
+QUOTA_STATUS = {429, "RESOURCE_EXHAUSTED"}
+TRANSIENT_STATUS = {500, 502, 503, 504, "UNAVAILABLE", "DEADLINE_EXCEEDED", "INTERNAL", "ABORTED"}
+
+# Message patterns (anchored regexes; bare numbers such as "5000 pixels" or "500m" never match)
+FATAL_PATTERNS = [r"memory limit exceeded", r"\bnot found\b", r"permission denied", r"\bdoes not exist\b"]
+QUOTA_PATTERNS = [r"(?:http(?:error)?|status|code)\W{0,3}429\b", r"\btoo many (?:requests|concurrent)", r"\bquota exceeded\b",
+                  r"\brate limit", r"\bresource_exhausted\b", r"\bcapacity exceeded\b"]
+TRANSIENT_PATTERNS = [r"(?:http(?:error)?|status|code)\W{0,3}50[0234]\b",
+                      r"\b50[0234] (?:internal server error|bad gateway|service unavailable|gateway time-?out)\b",
+                      r"\binternal error has occurred\b", r"\bservice unavailable\b", r"\bunavailable\b",
+                      r"\bdeadline[_ ]exceeded\b", r"\bcomputation timed out\b", r"\bread timed out\b",
+                      r"\bconnection (?:reset|aborted|refused)\b", r"\breset by peer\b", r"\btry again\b"]
+
+
+def error_status(error: Exception):
+    """
+    HTTP status (int) or gRPC status name (str) of an exception, if it has one:
+    googleapiclient `resp.status`, requests `response.status_code`, grpc `code()`.
+    """
+    resp = getattr(error, "resp", None)
+    if resp is not None and getattr(resp, "status", None) is not None:
+        return int(resp.status)
+    response = getattr(error, "response", None)
+    if response is not None and getattr(response, "status_code", None) is not None:
+        return int(response.status_code)
+    code = getattr(error, "code", None)
+    code = code() if callable(code) else code
+    if code is None:
+        return None
+    if isinstance(code, int):
+        return code
+    return str(getattr(code, "name", code)).upper()
+
+
+def classify_ee_error(error: Exception) -> str:
+    """
+    Classifies a download error as "quota", "too_large", "transient" or "fatal".
+
+    The HTTP/gRPC status of the exception wins; otherwise its message is matched
+    against FATAL_PATTERNS, QUOTA_PATTERNS and TRANSIENT_PATTERNS, in that order.
+    """
+    if is_too_large_error(error):
+        return "too_large"
+
+    status = error_status(error)
+    if status in QUOTA_STATUS:
+        return "quota"
+    if status in TRANSIENT_STATUS:
+        return "transient"
+    if isinstance(status, int) and 400 <= status < 600:
+        return "fatal"
+
+    message = " ".join(str(arg) for arg in error.args).lower() or str(error).lower()
+    if any(re.search(pattern, message) for pattern in FATAL_PATTERNS):
+        return "fatal"
+    if any(re.search(pattern, message) for pattern in QUOTA_PATTERNS):
+        return "quota"
+    if isinstance(error, (ConnectionError, TimeoutError)) or \
+            any(re.search(pattern, message) for pattern in TRANSIENT_PATTERNS):
+        return "transient"
+    return "fatal"
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit with additive increase / multiplicative decrease (AIMD).
+
+    Each throttle (429/quota) halves the limit. Each success adds 1/limit, so
+    the limit grows by one after a full window of successful requests.
+    """
+
+    def __init__(self, initial: int = 10, minimum: int = 1, maximum: int = 40):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def on_success(self) -> None:
+        with self._cond:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    def on_throttle(self) -> None:
+        with self._cond:
+            self.limit = max(self.minimum, self.limit / 2)
+
+
+class RequestScheduler:
+    """
+    Runs download calls with error classification, exponential backoff with
+    full jitter and an AIMD concurrency limit.
+
+    "quota" errors shrink the limit and are retried, "transient" errors are
+    retried, "too_large" and "fatal" errors are raised at once (the first is
+    handled by `fetch_and_save_adaptive`). `stats` counts requests, retries,
+    throttles and failures.
+
+    Example:
+        scheduler = RequestScheduler(max_in_flight=10)
+        fetch_and_save_adaptive(request, path, scheduler.wrap(fetch_and_save))
+    """
+
+    def __init__(
+            self,
+            max_in_flight: int = 10,
+            max_retries: int = 6,
+            base_delay: float = 2.0,
+            max_delay: float = 120.0,
+            limiter: AdaptiveLimiter = None,
+            sleep: Callable = time.sleep
+        ):
+        self.limiter = AdaptiveLimiter(initial=max_in_flight, maximum=max_in_flight) if limiter is None else limiter
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+        self.stats = collections.Counter()
+        self._lock = threading.Lock()
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self.stats[key] += 1
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, fetch: Callable, *args):
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            try:
+                self._count("requests")
+                result = fetch(*args)
+            except Exception as e:
+                kind = classify_ee_error(e)
+                if kind == "quota":
+                    self._count("throttles")
+                    self.limiter.on_throttle()
+                if kind in ("too_large", "fatal") or attempt == self.max_retries:
+                    self._count("failures" if kind != "too_large" else "too_large")
+                    raise
+                self._count("retries")
+            else:
+                self.limiter.on_success()
+                return result
+            finally:
+                self.limiter.release()
+            self.sleep(self.backoff(attempt))
+
+    def wrap(self, fetch: Callable) -> Callable:
+        return functools.partial(self.call, fetch)
+
+
+# ---------------------------------------------------------------------------------------------
+# Download engine shared by 1_download.py, 1_download_1m.py and 1_download_s2.py
+@dataclass
+class TileJob:
+    row_id: int
+    tile_index: int
+    request: dict
+    outname: object  # file path, or a MosaicTile
+
+
+def tile_files(outname) -> list:
+    """
+    Files written for a tile: `outname` if it exists (split requests are
+    mosaicked back into it by `fetch_and_save_adaptive`).
+    """
+    outname = pathlib.Path(outname)
+    return [outname] if outname.exists() else []
+
+
+def file_checksum(paths: list) -> str:
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as src:
+            for chunk in iter(lambda: src.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DownloadManifest:
+    """
+    Append-only JSONL record of the tiles of a download run.
+
+    One line per attempt: row id, tile index, grid, output path, byte size,
+    sha256 and status ("done" or "failed"). The last line of a tile wins, so the
+    file can be appended by a restarted run. A tile is skipped only if its last
+    status is "done", the grid is the same and the files on disk still match the
+    recorded size (and checksum, with `verify=True`).
+    """
+
+    def __init__(self, path, verify: bool = True):
+        self.path = pathlib.Path(path)
+        self.verify = verify
+        self.records = {}
+        self._lock = threading.Lock()
+
+        if self.path.exists():
+            with open(self.path) as src:
+                for line in src:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # truncated last line after a crash
+                    self.records[(record["row_id"], record["tile_index"])] = record
+
+    def _append(self, record: dict) -> None:
+        with self._lock:
+            self.records[(record["row_id"], record["tile_index"])] = record
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a") as dst:
+                dst.write(json.dumps(record) + "\n")
+                dst.flush()
+
+    @staticmethod
+    def _grid(job) -> dict:
+        return json.loads(json.dumps(job.request["grid"], default=str))
+
+    def is_done(self, job) -> bool:
+        record = self.records.get((int(job.row_id), job.tile_index))
+        if record is None or record["status"] != "done":
+            return False
+        if record["path"] != str(job.outname) or record["grid"] != self._grid(job):
+            return False
+        files = tile_files(job.outname)
+        if not files or sum(f.stat().st_size for f in files) != record["size"]:
+            return False
+        return not self.verify or file_checksum(files) == record["sha256"]
+
+    def mark_done(self, job) -> None:
+        files = tile_files(job.outname)
+        self._append({
+            "row_id": int(job.row_id),
+            "tile_index": job.tile_index,
+            "grid": self._grid(job),
+            "path": str(job.outname),
+            "size": sum(f.stat().st_size for f in files),
+            "sha256": file_checksum(files),
+            "status": "done",
+        })
+
+    def mark_failed(self, job, error: Exception) -> None:
+        self._append({
+            "row_id": int(job.row_id),
+            "tile_index": job.tile_index,
+            "grid": self._grid(job),
+            "path": str(job.outname),
+            "size": 0,
+            "sha256": None,
+            "status": "failed",
+            "error": str(error),
+        })
+
+
+class DownloadEngine:
+    """
+    Streams (row, tile) jobs from a table into one bounded worker pool.
+
+    `build_jobs(row)` builds the Earth Engine graph of a row and returns its
+    [(request, outname), ...]; it runs in a small pool a few rows ahead, so graph
+    construction overlaps the downloads of previous rows. `fetch(request, outname)`
+    runs in a single pool shared by all rows with at most `max_in_flight`
+    requests at a time (the Earth Engine concurrency quota). With a
+    `DownloadManifest`, tiles already downloaded and verified are skipped.
+    Tiles that still fail after the fetch's own retries (see `RequestScheduler`)
+    are re-queued after all rows, up to `max_requeues` times.
+
+    Example:
+        engine = DownloadEngine(build_jobs, fetch=fetch_and_save_adaptive, max_in_flight=10)
+        stats = engine.run(dataframe)
+    """
+
+    def __init__(
+            self,
+            build_jobs: Callable,
+            fetch: Callable = None,
+            max_in_flight: int = 10,
+            build_workers: int = 2,
+            build_ahead: int = 4,
+            manifest: DownloadManifest = None,
+            max_requeues: int = 1
+        ):
+        self.build_jobs = build_jobs
+        self.fetch = fetch_and_save_adaptive if fetch is None else fetch
+        self.max_in_flight = max_in_flight
+        self.build_workers = build_workers
+        self.build_ahead = build_ahead
+        self.manifest = manifest
+        self.max_requeues = max_requeues
+        self.failed = []
+        self.stats = collections.Counter()
+        self._lock = threading.Lock()
+
+    def _count(self, key: str, n: int = 1) -> None:
+        with self._lock:
+            self.stats[key] += n
+
+    def _built_rows(self, build_pool, table: pd.DataFrame):
+        """
+        Yields (row_id, jobs) in table order, keeping `build_ahead` rows in construction.
+        """
+        rows = iter(table.iterrows())
+        pending = collections.deque()
+
+        def submit_next():
+            for row_id, row in rows:
+                pending.append((row_id, build_pool.submit(self.build_jobs, row)))
+                return
+
+        for _ in range(self.build_ahead):
+            submit_next()
+
+        while pending:
+            row_id, future = pending.popleft()
+            submit_next()
+            try:
+                yield row_id, future.result()
+            except Exception as e:
+                print(f"Error construyendo la fila {row_id}: {e}")
+                self._count("build_errors")
+
+    def jobs(self, row_id: int, built: list) -> list:
+        return [
+            TileJob(row_id, n, request, outname)
+            for n, (request, outname) in enumerate(built)
+        ]
+
+    def submit(self, pool, slots, job: TileJob) -> None:
+        slots.acquire()
+        future = pool.submit(self.run_job, job)
+        future.add_done_callback(lambda f: self._done(f, slots, job))
+
+    def run_job(self, job: TileJob) -> bool:
+        """
+        Downloads a tile; returns False if the manifest says it is already on disk.
+        """
+        if self.manifest is not None and self.manifest.is_done(job):
+            return False
+        self.fetch(job.request, job.outname)
+        if self.manifest is not None:
+            self.manifest.mark_done(job)
+        return True
+
+    def _done(self, future, slots, job: TileJob) -> None:
+        slots.release()
+        try:
+            self._count("tiles" if future.result() else "skipped")
+        except Exception as e:
+            print(f"Error en una de las descargas (fila {job.row_id}, tile {job.tile_index}): {e}")
+            if self.manifest is not None:
+                self.manifest.mark_failed(job, e)
+            if classify_ee_error(e) != "fatal":
+                with self._lock:
+                    self.failed.append(job)
+            self._count("errors")
+
+    def run(self, table: pd.DataFrame) -> collections.Counter:
+        """
+        Downloads every tile of every row of `table`.
+
+        Returns:
+            collections.Counter: 'rows', 'tiles', 'skipped', 'errors', 'requeued',
+            'build_errors' and 'seconds'. Tiles still failing are left in `failed`.
+        """
+        start = time.perf_counter()
+        slots = threading.BoundedSemaphore(self.max_in_flight)
+
+        with concurrent.futures.ThreadPoolExecutor(self.max_in_flight) as fetch_pool, \
+             concurrent.futures.ThreadPoolExecutor(self.build_workers) as build_pool:
+            for row_id, built in self._built_rows(build_pool, table):
+                for job in self.jobs(row_id, built):
+                    self.submit(fetch_pool, slots, job)
+                self._count("rows")
+
+        for _ in range(self.max_requeues):
+            requeued, self.failed = self.failed, []
+            if not requeued:
+                break
+            print(f"Reintentando {len(requeued)} tiles")
+            self._count("requeued", len(requeued))
+            with concurrent.futures.ThreadPoolExecutor(self.max_in_flight) as fetch_pool:
+                for job in requeued:
+                    self.submit(fetch_pool, slots, job)
+
+        self.stats["seconds"] = round(time.perf_counter() - start, 1)
+        return self.stats
+
+
+# ---------------------------------------------------------------------------------------------
+# Streaming mosaic writer (tiles go straight into the final GeoTIFF)
+def mosaic_creation_options(profile: str = "archive", block_size: int = 256) -> list:
+    return creation_options(profile, block_size=block_size) + ["BIGTIFF=IF_SAFER"]
+
+
+MOSAIC_CREATION_OPTIONS = mosaic_creation_options("archive", 256)
+
+
+def ndarray_to_bands(array: np.ndarray) -> np.ndarray:
+    """
+    Converts a computePixels NUMPY_NDARRAY result (structured, one field per
+    band) to a (bands, height, width) array.
+    """
+    if array.dtype.names is not None:
+        return np.stack([array[name] for name in array.dtype.names])
+    return np.moveaxis(array, -1, 0)
+
+
+def to_uint16(array: np.ndarray, src_nodata: float = 0, dst_nodata: int = 65535) -> np.ndarray:
+    """
+    Same conversion as `warp_neon_dir` (srcNodata=0 / VRTNodata=65535, applied
+    band by band): rounds to UInt16 and maps every band value equal to
+    `src_nodata` to `dst_nodata`.
+    """
+    out = np.clip(np.rint(array), 0, dst_nodata - 1).astype(np.uint16)
+    out[array == src_nodata] = dst_nodata
+    return out
+
+
+class MosaicWriter:
+    """
+    Writes downloaded tiles directly into their window of a tiled, compressed
+    GeoTIFF, replacing the per-tile files and the `warp_neon_dir` pass.
+
+    The file is built as <path>.part and renamed when every window is written.
+    Finished windows are flushed and listed in <path>.part.json, so an
+    interrupted row resumes with `pending()`. Windows should be multiples of the
+    block size (`TilePlanner(align=256)`) so each block is compressed once.
+    The file is written with the compression `profile` and `block_size`
+    (see COMPRESSION_PROFILES) unless explicit `creation_options` are given;
+    with `cog=True` the finished file is copied into a COG with overviews using
+    the same profile and block size.
+    """
+
+    def __init__(
+            self,
+            path,
+            windows: list,
+            geotransform: tuple,
+            crs: str,
+            n_bands: int,
+            creation_options: list = None,
+            src_nodata: float = 0,
+            dst_nodata: int = 65535,
+            cog: bool = False,
+            overview_resampling: str = "AVERAGE",
+            profile: str = "archive",
+            block_size: int = 256
+        ):
+        self.path = pathlib.Path(path)
+        self.tmp_path = self.path.with_name(self.path.name + ".part")
+        self.state_path = self.path.with_name(self.path.name + ".part.json")
+        self.windows = windows
+        self.src_nodata = src_nodata
+        self.dst_nodata = dst_nodata
+        self.cog = cog
+        self.overview_resampling = overview_resampling
+        self.profile = profile
+        self.block_size = block_size
+        self.done = set()
+        self.ds = None
+        self._lock = threading.Lock()
+
+        if self.path.exists():
+            self.done = set(range(len(windows)))
+            return
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.tmp_path.exists() and self.state_path.exists():
+            self.ds = gdal.Open(self.tmp_path.as_posix(), gdal.GA_Update)
+            self.done = set(json.loads(self.state_path.read_text())["done"])
+            return
+
+        if creation_options is None:
+            creation_options = mosaic_creation_options(profile, block_size)
+        width = max(col + w for col, _, w, _ in windows)
+        height = max(row + h for _, row, _, h in windows)
+        self.ds = gdal.GetDriverByName("GTiff").Create(
+            self.tmp_path.as_posix(), width, height, n_bands, gdal.GDT_UInt16,
+            options=creation_options
+        )
+        self.ds.SetGeoTransform(geotransform)
+        srs = osr.SpatialReference()
+        srs.SetFromUserInput(crs)
+        self.ds.SetProjection(srs.ExportToWkt())
+        for b in range(1, n_bands + 1):
+            self.ds.GetRasterBand(b).SetNoDataValue(dst_nodata)
+
+    def pending(self) -> list:
+        return [n for n in range(len(self.windows)) if n not in self.done]
+
+    def write(self, col_off: int, row_off: int, array: np.ndarray) -> None:
+        """
+        Writes a (bands, height, width) array at the given pixel offset.
+        """
+        data = to_uint16(array, self.src_nodata, self.dst_nodata)
+        with self._lock:
+            self.ds.WriteArray(data, xoff=col_off, yoff=row_off)
+
+    def mark_done(self, index: int) -> None:
+        with self._lock:
+            self.ds.FlushCache()
+            self.done.add(index)
+            write_atomic(self.state_path, json.dumps({"done": sorted(self.done)}).encode())
+            if len(self.done) == len(self.windows):
+                self._finish()
+
+    def _finish(self) -> None:
+        self.ds = None
+        if self.cog:
+            cog_path = self.path.with_name(self.path.name + ".cog.part")
+            gdal.Translate(
+                cog_path.as_posix(), self.tmp_path.as_posix(), format="COG",
+                creationOptions=cog_creation_options(
+                    self.profile, self.block_size, overview_resampling=self.overview_resampling
+                )
+            )
+            os.replace(cog_path, self.path)
+            self.tmp_path.unlink()
+        else:
+            os.replace(self.tmp_path, self.path)
+        self.state_path.unlink(missing_ok=True)
+        print(f"{self.path} generado.")
+
+
+@dataclass
+class MosaicTile:
+    writer: MosaicWriter
+    index: int
+
+
+def fetch_into_mosaic(ulist, target: MosaicTile, fetch=None):
+    """
+    Downloads a NUMPY_NDARRAY request and writes it into its mosaic window.
+    Requests rejected as too large are split like `fetch_and_save_adaptive`.
+    """
+    fetch = ee.data.computePixels if fetch is None else fetch
+    col_off, row_off, _, _ = target.writer.windows[target.index]
+
+    def fetch_window(request, col, row):
+        try:
+            target.writer.write(col, row, ndarray_to_bands(fetch(request)))
+        except ee.ee_exception.EEException as ee_error:
+            if not is_too_large_error(ee_error):
+                raise
+            planner = TilePlanner.from_error(request, str(ee_error))
+            for window, subrequest in zip(planner.windows(), planner.subrequests(request)):
+                fetch_window(subrequest, col + window[0], row + window[1])
+
+    fetch_window(ulist, col_off, row_off)
+    target.writer.mark_done(target.index)
+
 
 def convert_utm_to_geographic(row):
     """
@@ -143,6 +1278,52 @@ def subdivide_row(row, tile_size=5160):
             tiles.append(row_copy)
     return tiles
 
+def subdivide_offsets(table: pd.DataFrame, tile_size=5160) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Tile offsets of `subdivide_table` without copying the table.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: For each tile, the position of its
+            source row and its x and y origin, in `subdivide_row` order
+            (row by row, then tile rows i, then tile columns j).
+    """
+    n_cols = np.ceil(table["distx"].to_numpy() / tile_size).astype(int)
+    n_rows = np.ceil(table["disty"].to_numpy() / tile_size).astype(int)
+    n_tiles = n_cols * n_rows
+
+    source = np.repeat(np.arange(len(table)), n_tiles)
+    # Position of each tile inside its row: k = i * n_cols + j
+    k = np.arange(n_tiles.sum()) - np.repeat(np.cumsum(n_tiles) - n_tiles, n_tiles)
+    i, j = np.divmod(k, n_cols[source])
+
+    x = table["x"].to_numpy()[source] + j * tile_size
+    y = table["y"].to_numpy()[source] - i * tile_size
+    return source, x, y
+
+def subdivide_table(table: pd.DataFrame, tile_size=5160, offsets_only=False) -> pd.DataFrame:
+    """
+    Table version of `subdivide_row`: every row is expanded into its
+    ceil(distx / tile_size) x ceil(disty / tile_size) tiles at once.
+
+    Args:
+        table (pd.DataFrame): Table with 'x', 'y', 'distx' and 'disty'.
+        tile_size (int, optional): Tile side in metres. Defaults to 5160.
+        offsets_only (bool, optional): Return only the source index and the new
+            'x'/'y' instead of all the columns. Defaults to False.
+
+    Returns:
+        pd.DataFrame: One row per tile, in the same order as
+            `pd.DataFrame([t for _, r in table.iterrows() for t in subdivide_row(r)])`.
+    """
+    source, x, y = subdivide_offsets(table, tile_size)
+    if offsets_only:
+        return pd.DataFrame({"source": table.index[source], "x": x, "y": y})
+
+    tiles = table.iloc[source].copy()
+    tiles["x"] = x
+    tiles["y"] = y
+    return tiles
+
 def calculate_centroid(row):
     coordinates = row['coordinates'][0]  # Accede a las coordenadas
     coords_array = np.array(coordinates)  # Convierte las coordenadas en un array de numpy
@@ -236,6 +1417,23 @@ def square_around_point(point_utm: ee.Geometry, side: float = 2565) -> box:
     return box(x_cen - half_side, y_cen - half_side,
                     x_cen + half_side, y_cen + half_side)
 
+def candidate_square(row: dict, client=None) -> ee.Geometry:
+    """
+    5160 m square (2580 m buffered bounds in the row UTM zone) around the
+    centroid of a candidate, as in `create_image_with_null_property`.
+    """
+    client = ee if client is None else client
+    point = client.Geometry.Point(
+        [float(row["lon_c"]),
+         float(row["lat_c"])]
+    )
+    return (point
+        .transform(row["epsg"], 1)
+        .buffer(2580)
+        .bounds()
+        .transform("EPSG:4326", 1)
+    )
+
 def create_image_with_null_property(row: dict) -> ee.Image:
     """
     Creates an image and computes the percentage of null (missing) values in a specified region.
@@ -251,16 +1449,7 @@ def create_image_with_null_property(row: dict) -> ee.Image:
         ee.Image: The base image with an additional property "nullPercent" indicating the percentage 
                   of missing data within the region.
     """
-    point = ee.Geometry.Point(
-        [float(row["lon_c"]), 
-         float(row["lat_c"])]
-    )
-    square_5120m = (point
-        .transform(row["epsg"], 1)
-        .buffer(2580)
-        .bounds()
-        .transform("EPSG:4326", 1)
-    )
+    square_5120m = candidate_square(row)
 
     base_img = ee.Image(row["neon_id_gee"])
     two_band = ee.Image.constant(1) \
@@ -288,6 +1477,72 @@ def create_image_with_null_property(row: dict) -> ee.Image:
         "nullPercent": null_percent
     })
 
+def screen_null_percent(
+        table: pd.DataFrame,
+        scale: float = 100,
+        rows_per_request: int = 5000,
+        client=None
+    ) -> pd.Series:
+    """
+    Batch version of `create_image_with_null_property`.
+
+    The candidate squares are grouped by NEON asset and counted with one
+    `reduceRegions` per asset; the counts of many assets are merged into a
+    single FeatureCollection and fetched with one `ee.data.computeValue`, so
+    the number of evaluations is O(requests) instead of O(rows).
+
+    Args:
+        table (pd.DataFrame): Candidates with 'lon_c', 'lat_c', 'epsg' and 'neon_id_gee'.
+        scale (float, optional): Reduction scale in metres. Defaults to 100.
+        rows_per_request (int, optional): Rows fetched per request (whole assets
+            are never split). Defaults to 5000.
+        client (optional): Earth Engine client module; a local stub can be passed
+            for testing. Defaults to `ee`.
+
+    Returns:
+        pd.Series: nullPercent of every row, with the index of `table`.
+    """
+    client = ee if client is None else client
+
+    requests, current, n_rows = [], [], 0
+    for neon_id, group in table.groupby("neon_id_gee", sort=False):
+        if current and n_rows + len(group) > rows_per_request:
+            requests.append(current)
+            current, n_rows = [], 0
+        current.append((neon_id, group))
+        n_rows += len(group)
+    if current:
+        requests.append(current)
+
+    # Features are tagged with the row position (JSON-serializable whatever the index)
+    positions = pd.Series(np.arange(len(table)), index=table.index)
+    null_percent = np.full(len(table), np.nan)
+    for request in requests:
+        collections_ = []
+        for neon_id, group in request:
+            squares = client.FeatureCollection([
+                client.Feature(candidate_square(row, client), {"row": int(position)})
+                for position, row in zip(positions[group.index], group.to_dict("records"))
+            ])
+            two_band = client.Image.constant(1) \
+                         .rename("constant") \
+                         .addBands(client.Image(neon_id).select("B001"))
+            collections_.append(
+                two_band.reduceRegions(
+                    collection=squares,
+                    reducer=client.Reducer.count(),
+                    scale=scale
+                )
+            )
+        merged = client.FeatureCollection(collections_).flatten() \
+                       .select(["row", "constant", "B001"], None, False)
+        for ft in client.data.computeValue(merged)["features"]:
+            props = ft["properties"]
+            total = props.get("constant") or 0
+            valid = props.get("B001") or 0
+            null_percent[props["row"]] = (total - valid) / total * 100 if total else np.nan
+    return pd.Series(null_percent, index=table.index, name="nullPercent")
+
 def query_utm_crs_info(lon: float, lat: float) -> Tuple[float, float, str]:
     """
     Converts latitude and longitude coordinates to UTM coordinates and returns the UTM zone 
@@ -305,191 +1560,1568 @@ def query_utm_crs_info(lon: float, lat: float) -> Tuple[float, float, str]:
     return x, y, "EPSG:" + zone_epsg
 
 
+# ---------------------------------------------------------------------------------------------
+# Vectorized geometry helpers (whole columns, one `utm` call per UTM zone)
+def latlon_to_zone_numbers(lat, lon) -> np.ndarray:
+    """
+    Array version of `utm.latlon_to_zone_number` (Norway and Svalbard
+    exceptions included).
+    """
+    lat = np.asarray(lat, dtype=float)
+    lon = (np.asarray(lon, dtype=float) % 360 + 540) % 360 - 180
+    zone = ((lon + 180) / 6).astype(int) + 1
+
+    zone = np.where((lat >= 56) & (lat < 64) & (lon >= 3) & (lon < 12), 32, zone)
+    svalbard = (lat >= 72) & (lat <= 84) & (lon >= 0)
+    for lon_max, svalbard_zone in [(9, 31), (21, 33), (33, 35), (42, 37)]:
+        zone = np.where(svalbard & (lon < lon_max), svalbard_zone, zone)
+        svalbard &= lon >= lon_max
+    return zone
+
 
-def to_image(id_str: str) -> ee.Image:
+def get_utm_epsg_array(lat, lon) -> np.ndarray:
     """
-    Converts a string representing an image ID to an Earth Engine image object.
+    Array version of `get_utm_epsg`: EPSG codes (326zz north, 327zz south) as ints.
+    """
+    zone = latlon_to_zone_numbers(lat, lon)
+    return np.where(np.asarray(lat, dtype=float) >= 0, 32600, 32700) + zone
 
-    Args:
-        id_str (str): The image ID string.
 
-    Returns:
-        ee.Image: The Earth Engine image object corresponding to the input ID.
+def epsg_to_codes(epsg) -> np.ndarray:
     """
-    return ee.Image(id_str)
+    Parses a column of EPSG codes ("EPSG:32613" strings or ints) into ints.
+    """
+    epsg = pd.Series(np.asarray(epsg).ravel())
+    if not pd.api.types.is_numeric_dtype(epsg):
+        epsg = epsg.astype(str).str.rsplit(":", n=1).str[-1]
+    return epsg.astype(int).to_numpy()
 
 
+def geo2utm_array(lon, lat) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Array version of `geo2utm` (and `query_utm_crs_info`).
 
+    The points are grouped by UTM zone and hemisphere, and each group is
+    projected with a single `utm.from_latlon` call.
 
-#################################
-## Download NEON and S2 images ##
-#################################
+    Args:
+        lon (array-like): Longitudes.
+        lat (array-like): Latitudes.
 
-# ---------------------------------------------------------------------------------------------
-# SpectralData class to manage everything
-@dataclass
-class SpectralData:
-    image: ee.Image
-    s2_table: pd.DataFrame
-    bands_s2: list
-
-    def __init__(self, image: ee.Image, s2_table: pd.DataFrame):
-        self.image = image
-        self.s2_table = s2_table
-        self.bands_s2 = ["B1", "B2", "B3", "B4", "B5", "B6", "B7", "B8", "B8A", "B9", "B10", "B11", "B12"]
-
-        # Prepare spectral bands and metadata for NEON
-        self.bands_neon_select = [f"B{i:03d}" for i in range(1, 427)]
-        self.band_metadata_neon = [f"WL_FWHM_{band}" for band in self.bands_neon_select]
-        self.bands_neon_ee_select = ee.List(self.bands_neon_select)
-
-        # Extract wavelengths for NEON bands from the image
-        self.wavelength = ee.List([
-            ee.Number.parse(
-                ee.String(self.image.get(bandName)).split(",").get(0)
-            ) for bandName in self.band_metadata_neon
-        ])
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: x, y and "EPSG:326zz"/"EPSG:327zz" strings.
 
-    def get_wavelengths(self) -> ee.List:
-        return self.wavelength
-    
-# Interpolation Functions
-def _make_segment_dict(pair: ee.List) -> ee.Dictionary:
-    pair = ee.List(pair)
-    xvals = ee.List(pair.get(0))  # [x0, x1]
-    yvals = ee.List(pair.get(1))  # [y0, y1]
-    x0 = ee.Number(xvals.get(0))
-    x1 = ee.Number(xvals.get(1))
-    y0 = ee.Number(yvals.get(0))
-    y1 = ee.Number(yvals.get(1))
-    m = y1.subtract(y0).divide(x1.subtract(x0))
-    return ee.Dictionary({'x0': x0, 'x1': x1, 'y0': y0, 'y1': y1, 'm': m})
-
-def prepare_segments(x_values: ee.List, y_values: ee.List) -> ee.List:
-    pairs = x_values.slice(0, -1).zip(x_values.slice(1))
-    pairs = pairs.zip(y_values.slice(0, -1).zip(y_values.slice(1)))
-    segments = pairs.map(lambda pair: _make_segment_dict(pair))
-    return segments
-
-def interpolate_one_x(segments: ee.List, xq: ee.Number) -> ee.Number:
-    candidates = segments.map(
-        lambda seg: ee.Algorithms.If(
-            ee.Number(ee.Dictionary(seg).get('x0')).lte(xq).And(
-                ee.Number(ee.Dictionary(seg).get('x1')).gte(xq)
-            ),
-            ee.Number(ee.Dictionary(seg).get('y0')).add(
-                ee.Number(ee.Dictionary(seg).get('m'))
-                  .multiply(xq.subtract(ee.Number(ee.Dictionary(seg).get('x0'))))
-            ),
-            None
-        )
-    )
-    return ee.List(candidates).removeAll([None]).get(0)
-
-def linear_interpolation(
-        x_values: ee.List, 
-        y_values: ee.List, 
-        x_query: ee.List
-    ) -> ee.List:
-    segs = prepare_segments(x_values, y_values)
-    result = x_query.map(lambda xq: interpolate_one_x(segs, ee.Number(xq)))
-    return result
-
-def create_interp1d(
-        x_values: ee.List,
-        y_values: ee.List,
-        kind: str = 'linear'
-    ) -> Callable[[ee.List], ee.List]:
-    if kind != 'linear':
-        raise ValueError("Only 'linear' supported.")
-    def _interpolator(x_query: ee.List) -> ee.List:
-        return linear_interpolation(x_values, y_values, x_query)
-    return _interpolator
-
-
-# Generalized function to generate S2 band from NEON
-def generate_s2_band_from_neon(
-        image_neon: ee.Image, 
-        s2_table: pd.DataFrame, 
-        band_name_s2: str, 
-        wave_neon: ee.List, 
-        bands_neon_ee_select: ee.List
-    ) -> ee.Image:
+    Example:
+        table["x_c"], table["y_c"], table["epsg"] = geo2utm_array(table["lon_c"], table["lat_c"])
     """
-    Generate one band from NEON using interpolation and Sentinel-2 SRF from the table.
-    """
-    col_name = s2_table.columns[1][:-2] + band_name_s2
-    mask = s2_table[col_name] != 0
-    xvals = s2_table['SR_WL'][mask].astype(float).tolist()
-    yvals = s2_table[col_name][mask].astype(float).tolist()
-    s2_srfx = ee.List(xvals)
-    s2_srfy = ee.List(yvals)
-    x_min = min(xvals)
-    x_max = max(xvals)
-    widx = wave_neon.map(lambda w: ee.Number(w).gte(x_min).And(ee.Number(w).lte(x_max)))
-    neon_srfx = (wave_neon.zip(widx)
-                 .map(lambda pair: ee.Algorithms.If(
-                     ee.List(pair).get(1), ee.List(pair).get(0), None
-                 ))
-                 .removeAll([None])
-                )
-    interp_fun = create_interp1d(s2_srfx, s2_srfy, 'linear')
-    neon_srfx_interp = interp_fun(neon_srfx)
-    sum_val = neon_srfx_interp.reduce(ee.Reducer.sum())
-    neon_srfx_norm = neon_srfx_interp.map(lambda elem: ee.Number(elem).divide(sum_val))
-    bands_filt = (bands_neon_ee_select.zip(widx)
-                  .map(lambda pair: ee.Algorithms.If(
-                      ee.List(pair).get(1), ee.List(pair).get(0), None
-                  ))
-                  .removeAll([None])
-                 )
-    selected_bands_img = image_neon.select(bands_filt)
-    weights_img = ee.Image.constant(neon_srfx_norm)
-    weighted_img = selected_bands_img.multiply(weights_img)
-    final_single_band = weighted_img.reduce(ee.Reducer.sum()).rename(band_name_s2) # .round().toInt16()
-    return final_single_band
+    lon = np.asarray(lon, dtype=float)
+    lat = np.asarray(lat, dtype=float)
+    codes = get_utm_epsg_array(lat, lon)
+
+    x = np.empty(lat.shape)
+    y = np.empty(lat.shape)
+    for code in np.unique(codes):
+        mask = codes == code
+        x[mask], y[mask], _, _ = utm.from_latlon(
+            lat[mask], lon[mask],
+            force_zone_number=int(code % 100),
+            force_northern=bool(code < 32700)
+        )
+    return x, y, np.char.add("EPSG:", codes.astype(str)).astype(object)
 
-# Generate all S2 bands and combine them into a single image
-def generate_s2_image_from_neon(neon_id_image: str, s2_id_image: str) -> ee.Image:
-    """
-    Generates an image with 13 Sentinel-2 bands from NEON.
+
+def utm_to_geographic_array(x, y, epsg) -> Tuple[np.ndarray, np.ndarray]:
     """
+    Array version of `convert_utm_to_geographic`, one `utm.to_latlon` call
+    per EPSG code.
 
-    image = ee.Image(neon_id_image)
-    image_s2 = ee.Image(s2_id_image)
+    Args:
+        x (array-like): UTM eastings.
+        y (array-like): UTM northings.
+        epsg (array-like): EPSG codes ("EPSG:32613" strings or ints).
 
-    # Get spacecraft name to determine which Sentinel-2 table to use
-    spacecraft_name = image_s2.get("SPACECRAFT_NAME")
-    result = ee.Algorithms.If(
-        ee.String(spacecraft_name).equals("Sentinel-2A"),
-        "Sentinel-2A",
-        ee.Algorithms.If(
-            ee.String(spacecraft_name).equals("Sentinel-2B"),
-            "Sentinel-2B",
-            "Unknown"
-        )
-    )
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Latitudes and longitudes.
 
-    # Select appropriate Sentinel-2 SRF table
-    type_s2 = result.getInfo()
+    Example:
+        table["lat_c"], table["lon_c"] = utm_to_geographic_array(table["x_c"], table["y_c"], table["epsg"])
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    codes = epsg_to_codes(epsg)
+
+    lat = np.empty(x.shape)
+    lon = np.empty(x.shape)
+    for code in np.unique(codes):
+        mask = codes == code
+        lat[mask], lon[mask] = utm.to_latlon(
+            x[mask], y[mask], int(code % 100), northern=bool(code < 32700)
+        )
+    return lat, lon
 
-    if type_s2 == "Sentinel-2A":
-        s2_table_selected = pd.read_csv("https://raw.githubusercontent.com/JulioContrerasH/neon2s2/refs/heads/main/tables/srf_s2a.csv")
-    elif type_s2 == "Sentinel-2B":
-        s2_table_selected = pd.read_csv("https://raw.githubusercontent.com/JulioContrerasH/neon2s2/refs/heads/main/tables/srf_s2b.csv")
-    else:
-        s2_table_selected = None
 
-    # Create SpectralData instance
-    spectral_data = SpectralData(image=image, s2_table=s2_table_selected)
-    print(spectral_data.bands_s2)
+def _ring_bounds(coordinates) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    min/max lon and lat of the outer ring of each polygon ('coordinates'
+    column), reduced over all the vertices at once.
+    """
+    rings = [np.asarray(c[0], dtype=float).reshape(-1, 2) for c in coordinates]
+    points = np.concatenate(rings)
+    starts = np.cumsum([0] + [len(r) for r in rings[:-1]])
+    return (
+        np.minimum.reduceat(points[:, 0], starts),
+        np.maximum.reduceat(points[:, 0], starts),
+        np.minimum.reduceat(points[:, 1], starts),
+        np.maximum.reduceat(points[:, 1], starts),
+    )
 
-    final_bands = []
-    for band in spectral_data.bands_s2:
-        one_band_img = generate_s2_band_from_neon(spectral_data.image, spectral_data.s2_table, band, spectral_data.get_wavelengths(), spectral_data.bands_neon_ee_select)
-        final_bands.append(one_band_img)
-        print(f"Generated band {band}")
 
-    final_s2_like_image = ee.Image(final_bands).rename(list(spectral_data.bands_s2))
+def calculate_centroid_array(coordinates) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Array version of `calculate_centroid`: bounding-box centre (lon, lat) of
+    every polygon of a 'coordinates' column.
+    """
+    lon_min, lon_max, lat_min, lat_max = _ring_bounds(coordinates)
+    return (lon_max - lon_min) / 2 + lon_min, (lat_max - lat_min) / 2 + lat_min
+
+
+def calculate_coord_array(coordinates) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Array version of `calculate_coord`: upper-left corner (min lon, max lat)
+    of every polygon of a 'coordinates' column.
+    """
+    lon_min, _, _, lat_max = _ring_bounds(coordinates)
+    return lon_min, lat_max
+
+
+
+def to_image(id_str: str) -> ee.Image:
+    """
+    Converts a string representing an image ID to an Earth Engine image object.
+
+    Args:
+        id_str (str): The image ID string.
+
+    Returns:
+        ee.Image: The Earth Engine image object corresponding to the input ID.
+    """
+    return ee.Image(id_str)
+
+
+
+
+#################################
+## Download NEON and S2 images ##
+#################################
+
+# ---------------------------------------------------------------------------------------------
+# Client-side spectral convolution (NumPy)
+S2_BANDS = ["B1", "B2", "B3", "B4", "B5", "B6", "B7", "B8", "B8A", "B9", "B10", "B11", "B12"]
+NEON_BANDS = [f"B{i:03d}" for i in range(1, 427)]
+
+TABLES_DIR = pathlib.Path(__file__).parent / "tables"
+SRF_TABLES = {
+    "Sentinel-2A": "srf_s2a.csv",
+    "Sentinel-2B": "srf_s2b.csv",
+}
+SRF_TABLES_URL = "https://raw.githubusercontent.com/JulioContrerasH/neon2s2/refs/heads/main/tables/"
+
+
+def load_srf_table(spacecraft: str) -> pd.DataFrame:
+    """
+    Loads the Sentinel-2 spectral response function (SRF) table of a spacecraft.
+
+    The tables are not shipped with this repository: a copy placed in
+    ``tables/`` (srf_s2a.csv / srf_s2b.csv) is used when present, otherwise the
+    table is downloaded from the neon2s2 repository (SRF_TABLES_URL). With a
+    `cache_dir`, `cached_srf_table` keeps the downloaded copy, so the download
+    happens once per cache directory.
+
+    Args:
+        spacecraft (str): "Sentinel-2A" or "Sentinel-2B".
+
+    Returns:
+        pd.DataFrame: Table with the 'SR_WL' column and one SRF column per band.
+    """
+    if spacecraft not in SRF_TABLES:
+        raise ValueError(f"Unknown spacecraft: {spacecraft}")
+    local_table = TABLES_DIR / SRF_TABLES[spacecraft]
+    if local_table.exists():
+        return pd.read_csv(local_table)
+    return pd.read_csv(SRF_TABLES_URL + SRF_TABLES[spacecraft])
+
+
+def parse_neon_wavelengths(properties: dict) -> np.ndarray:
+    """
+    Parses the 'WL_FWHM_B*' properties of a NEON image ("wavelength,fwhm").
+
+    Args:
+        properties (dict): Image properties containing one 'WL_FWHM_Bxxx' key per band.
+
+    Returns:
+        np.ndarray: Center wavelength (nm) of each NEON band, in band order.
+    """
+    return np.array([
+        float(str(properties[f"WL_FWHM_{band}"]).split(",")[0]) for band in NEON_BANDS
+    ])
+
+
+def get_neon_wavelengths(image_neon: ee.Image) -> np.ndarray:
+    """
+    Retrieves the NEON band wavelengths with a single getInfo call.
+    """
+    properties = image_neon.toDictionary([f"WL_FWHM_{band}" for band in NEON_BANDS]).getInfo()
+    return parse_neon_wavelengths(properties)
+
+
+def compute_srf_weights(
+        wavelengths: np.ndarray,
+        s2_table: pd.DataFrame,
+        bands_s2: list = S2_BANDS
+    ) -> np.ndarray:
+    """
+    Computes the normalized NEON -> Sentinel-2 convolution weights.
+
+    The SRF (non-zero samples only) is linearly interpolated at every NEON
+    wavelength inside its range and each band is normalized to sum one.
+
+    Args:
+        wavelengths (np.ndarray): NEON center wavelengths (n_neon,).
+        s2_table (pd.DataFrame): Sentinel-2 SRF table (see `load_srf_table`).
+        bands_s2 (list, optional): Sentinel-2 bands to compute. Defaults to S2_BANDS.
+
+    Returns:
+        np.ndarray: Weight matrix of shape (n_neon, n_bands_s2).
+    """
+    wavelengths = np.asarray(wavelengths, dtype=float)
+    prefix = s2_table.columns[1][:-2]
+    srf_wl = s2_table["SR_WL"].to_numpy(dtype=float)
+
+    weights = np.zeros((wavelengths.size, len(bands_s2)))
+    for k, band in enumerate(bands_s2):
+        srf = s2_table[prefix + band].to_numpy(dtype=float)
+        mask = srf != 0
+        xvals, yvals = srf_wl[mask], srf[mask]
+        inside = (wavelengths >= xvals.min()) & (wavelengths <= xvals.max())
+        weights[inside, k] = np.interp(wavelengths[inside], xvals, yvals)
+
+    total = weights.sum(axis=0)
+    return weights / np.where(total == 0, 1, total)
+
+
+def apply_srf_weights(
+        image_neon: ee.Image,
+        weights: np.ndarray,
+        bands_s2: list = S2_BANDS
+    ) -> ee.Image:
+    """
+    Convolves a NEON image with a constant weight matrix in one matrixMultiply.
+
+    Args:
+        image_neon (ee.Image): NEON hyperspectral image (bands B001..B426).
+        weights (np.ndarray): Weight matrix (n_neon, n_bands_s2) from `compute_srf_weights`.
+        bands_s2 (list, optional): Names of the output bands. Defaults to S2_BANDS.
+
+    Returns:
+        ee.Image: Image with one band per Sentinel-2 band.
+    """
+    # Only NEON bands with a non-zero weight in some S2 band are sent to the server
+    used = np.flatnonzero(np.any(weights != 0, axis=1))
+    bands_neon = [NEON_BANDS[i] for i in used]
+
+    weights_img = ee.Image(ee.Array(weights[used].T.tolist()))  # (n_bands_s2, n_used)
+    pixels_img = image_neon.select(bands_neon).toArray().toArray(1)  # (n_used, 1)
+
+    return (weights_img
+            .matrixMultiply(pixels_img)
+            .arrayProject([0])
+            .arrayFlatten([list(bands_s2)]))
+
+
+# ---------------------------------------------------------------------------------------------
+# Spectral cache (in-process LRU + optional .npz files on disk)
+#
+# Disk layout under `cache_dir`:
+#   srf/<srf_s2x>.csv                          SRF tables
+#   <HSI_REFL_00x>/wavelengths/<asset>.npz     NEON wavelength vectors
+#   <HSI_REFL_00x>/weights/<spacecraft>_<sha1>.npz   weight matrices
+# Everything derived from NEON lives under its asset version, so a new
+# version never reuses stale entries and can be dropped with `clear_spectral_cache`.
+
+def neon_asset_version(neon_id: str) -> str:
+    """
+    Extracts the NEON asset version from an Earth Engine id.
+
+    Example: "projects/neon-prod-earthengine/assets/HSI_REFL/001/2018_MLBS_3" -> "HSI_REFL/001"
+    """
+    parts = neon_id.split("/")
+    if "HSI_REFL" in parts:
+        i = parts.index("HSI_REFL")
+        return "/".join(parts[i:i + 2])
+    return "unknown"
+
+
+def _version_dir(cache_dir, version: str) -> pathlib.Path:
+    return pathlib.Path(cache_dir) / version.replace("/", "_")
+
+
+def _readonly(array: np.ndarray) -> np.ndarray:
+    array.setflags(write=False)
+    return array
+
+
+@functools.lru_cache(maxsize=None)
+def cached_srf_table(spacecraft: str, cache_dir: str = None) -> pd.DataFrame:
+    """
+    `load_srf_table` fetched once per process (and once per `cache_dir` on disk).
+    The returned table is shared; do not modify it.
+    """
+    if cache_dir is None:
+        return load_srf_table(spacecraft)
+
+    path = pathlib.Path(cache_dir) / "srf" / SRF_TABLES[spacecraft]
+    if path.exists():
+        return pd.read_csv(path)
+
+    table = load_srf_table(spacecraft)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    table.to_csv(path, index=False)
+    return table
+
+
+@functools.lru_cache(maxsize=256)
+def cached_neon_wavelengths(neon_id: str, cache_dir: str = None) -> np.ndarray:
+    """
+    `get_neon_wavelengths` memoized by NEON asset id (read-only array).
+    """
+    path = None
+    if cache_dir is not None:
+        path = (_version_dir(cache_dir, neon_asset_version(neon_id))
+                / "wavelengths" / (neon_id.split("/")[-1] + ".npz"))
+        if path.exists():
+            with np.load(path) as data:
+                if str(data["neon_id"]) == neon_id:
+                    return _readonly(data["wavelengths"])
+
+    wavelengths = get_neon_wavelengths(ee.Image(neon_id))
+    if path is not None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez(path, neon_id=neon_id, wavelengths=wavelengths)
+    return _readonly(wavelengths)
+
+
+@functools.lru_cache(maxsize=256)
+def _cached_srf_weights(
+        spacecraft: str,
+        wavelengths: tuple,
+        version: str,
+        cache_dir: str
+    ) -> np.ndarray:
+    path = None
+    if cache_dir is not None:
+        digest = hashlib.sha1(np.asarray(wavelengths, dtype=float).tobytes()).hexdigest()
+        path = (_version_dir(cache_dir, version) / "weights"
+                / f"{spacecraft.replace('-', '').lower()}_{digest}.npz")
+        if path.exists():
+            with np.load(path) as data:
+                return _readonly(data["weights"])
+
+    weights = compute_srf_weights(np.array(wavelengths), cached_srf_table(spacecraft, cache_dir))
+    if path is not None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez(path, weights=weights)
+    return _readonly(weights)
+
+
+def cached_srf_weights(
+        spacecraft: str,
+        wavelengths: np.ndarray,
+        version: str = "unknown",
+        cache_dir: str = None
+    ) -> np.ndarray:
+    """
+    `compute_srf_weights` memoized by (spacecraft, NEON wavelength vector).
+
+    Args:
+        spacecraft (str): "Sentinel-2A" or "Sentinel-2B".
+        wavelengths (np.ndarray): NEON center wavelengths.
+        version (str, optional): NEON asset version (see `neon_asset_version`).
+        cache_dir (str, optional): Directory for the on-disk cache. Defaults to memory only.
+
+    Returns:
+        np.ndarray: Read-only weight matrix (n_neon, 13).
+    """
+    return _cached_srf_weights(
+        spacecraft,
+        tuple(float(w) for w in wavelengths),
+        version,
+        None if cache_dir is None else str(cache_dir)
+    )
+
+
+def clear_spectral_cache(neon_version: str = None, cache_dir: str = None) -> None:
+    """
+    Invalidates the spectral cache.
+
+    The in-process caches are always cleared. On disk, only the entries of
+    `neon_version` (e.g. "HSI_REFL/001") are removed, or the whole `cache_dir`
+    when no version is given.
+    """
+    cached_neon_wavelengths.cache_clear()
+    _cached_srf_weights.cache_clear()
+    if neon_version is None:
+        cached_srf_table.cache_clear()
+
+    if cache_dir is None:
+        return
+    target = pathlib.Path(cache_dir) if neon_version is None else _version_dir(cache_dir, neon_version)
+    if target.exists():
+        shutil.rmtree(target)
+
+
+# ---------------------------------------------------------------------------------------------
+# Batch metadata prefetch (a few bulk round-trips for the whole pairs table)
+
+def _chunks(values: list, size: int):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def _compute_properties(features: list) -> list:
+    """
+    Evaluates a list of ee.Feature in a single request and returns their properties.
+    """
+    result = ee.data.computeValue(ee.FeatureCollection(features))
+    return [ft["properties"] for ft in result["features"]]
+
+
+def fetch_spacecraft_names(s2_ids: list, chunk_size: int = 500) -> dict:
+    """
+    Retrieves 'SPACECRAFT_NAME' for many Sentinel-2 images.
+
+    Args:
+        s2_ids (list): Sentinel-2 Earth Engine ids.
+        chunk_size (int, optional): Images per request. Defaults to 500.
+
+    Returns:
+        dict: {s2_id: spacecraft name}
+    """
+    names = {}
+    for chunk in _chunks(list(s2_ids), chunk_size):
+        features = [
+            ee.Feature(None, {"id": s2_id, "name": ee.Image(s2_id).get("SPACECRAFT_NAME")})
+            for s2_id in chunk
+        ]
+        for props in _compute_properties(features):
+            names[props["id"]] = props.get("name")
+    return names
+
+
+def fetch_neon_wavelengths(neon_ids: list, chunk_size: int = 50) -> dict:
+    """
+    Retrieves the 'WL_FWHM_B*' wavelengths of many NEON images.
+
+    Args:
+        neon_ids (list): NEON Earth Engine ids.
+        chunk_size (int, optional): Images per request (426 properties each). Defaults to 50.
+
+    Returns:
+        dict: {neon_id: np.ndarray of center wavelengths}
+    """
+    properties = [f"WL_FWHM_{band}" for band in NEON_BANDS]
+    wavelengths = {}
+    for chunk in _chunks(list(neon_ids), chunk_size):
+        features = [
+            ee.Feature(None, ee.Image(neon_id).toDictionary(properties).set("id", neon_id))
+            for neon_id in chunk
+        ]
+        for props in _compute_properties(features):
+            wavelengths[props["id"]] = parse_neon_wavelengths(props)
+    return wavelengths
+
+
+def wavelengths_to_str(wavelengths: np.ndarray) -> str:
+    # repr round-trips exactly: same SRF weights and cache keys as the getInfo() path
+    return ",".join(repr(float(w)) for w in wavelengths)
+
+
+def wavelengths_from_str(value: str) -> np.ndarray:
+    return np.array([float(w) for w in value.split(",")])
+
+
+def prefetch_pair_metadata(table: pd.DataFrame) -> pd.DataFrame:
+    """
+    Resolves the spacecraft of every S2 image and the wavelengths of every NEON
+    image of the pairs table in a few bulk requests.
+
+    Adds (or completes) the columns 's2_spacecraft' and 'neon_wavelengths'
+    (comma separated, see `wavelengths_from_str`). Rows that already have a
+    value are not requested again, so the table can be saved and reused.
+
+    Args:
+        table (pd.DataFrame): Pairs table with 's2_id_gee' and 'neon_id_gee' columns.
+
+    Returns:
+        pd.DataFrame: Copy of the table with the two columns filled.
+    """
+    table = table.copy()
+    for column in ["s2_spacecraft", "neon_wavelengths"]:
+        if column not in table.columns:
+            table[column] = None
+
+    missing = table["s2_spacecraft"].isna()
+    if missing.any():
+        names = fetch_spacecraft_names(table.loc[missing, "s2_id_gee"].unique())
+        table.loc[missing, "s2_spacecraft"] = table.loc[missing, "s2_id_gee"].map(names)
+
+    missing = table["neon_wavelengths"].isna()
+    if missing.any():
+        wavelengths = fetch_neon_wavelengths(table.loc[missing, "neon_id_gee"].unique())
+        as_str = {neon_id: wavelengths_to_str(wl) for neon_id, wl in wavelengths.items()}
+        table.loc[missing, "neon_wavelengths"] = table.loc[missing, "neon_id_gee"].map(as_str)
+
+    return table
+
+
+# Generate all S2 bands and combine them into a single image
+def generate_s2_image_from_neon(
+        neon_id_image: str,
+        s2_id_image: str,
+        cache_dir: str = None,
+        spacecraft: str = None,
+        wavelengths: np.ndarray = None
+    ) -> ee.Image:
+    """
+    Generates an image with 13 Sentinel-2 bands from NEON.
+
+    The SRF weights are computed locally (`compute_srf_weights`) and applied
+    server-side as a single matrix multiply. SRF tables, NEON wavelengths and
+    weights are cached (see `cached_srf_weights`). When `spacecraft` and
+    `wavelengths` come from `prefetch_pair_metadata`, no request is made at all.
+    """
+
+    image = ee.Image(neon_id_image)
+
+    # Get spacecraft name to determine which Sentinel-2 table to use
+    if spacecraft is None:
+        spacecraft = ee.Image(s2_id_image).get("SPACECRAFT_NAME").getInfo()
+
+    cache_dir = None if cache_dir is None else str(cache_dir)
+    if wavelengths is None:
+        wavelengths = cached_neon_wavelengths(neon_id_image, cache_dir)
+
+    weights = cached_srf_weights(
+        spacecraft,
+        wavelengths,
+        version=neon_asset_version(neon_id_image),
+        cache_dir=cache_dir
+    )
+    final_s2_like_image = apply_srf_weights(image, weights)
+
+    return final_s2_like_image
 
-    return final_s2_like_image
\ No newline at end of file
+
+###########################
+## Raster metadata cache ##
+###########################
+
+# ---------------------------------------------------------------------------------------------
+# Block-streaming band statistics
+def iter_block_windows(ds) -> list:
+    """
+    Returns the (xoff, yoff, width, height) windows of the internal blocks of
+    a GDAL dataset (band 1 block size), row by row.
+    """
+    block_x, block_y = ds.GetRasterBand(1).GetBlockSize()
+    return [
+        (x, y, min(block_x, ds.RasterXSize - x), min(block_y, ds.RasterYSize - y))
+        for y in range(0, ds.RasterYSize, block_y)
+        for x in range(0, ds.RasterXSize, block_x)
+    ]
+
+
+class BlockAccumulator:
+    """
+    Per-band statistics of a raster accumulated one block at a time: min, max,
+    sum, null count and pixels null in every / any band (`nodata` may be one
+    value or a tuple of them); with `valid_range`
+    also the out-of-range count and a histogram of `bins` bins over it.
+    Shared by `raster_band_stats`, `raster_null_coverage` and `validate_raster`.
+    """
+
+    def __init__(self, n_bands: int, nodata: float = None, valid_range: tuple = None, bins: int = 50):
+        self.n_bands = n_bands
+        self.nodata = nodata
+        self.valid_range = valid_range
+        self.edges = None if valid_range is None else np.linspace(valid_range[0], valid_range[1], bins + 1)
+        self.n_pixels = 0
+        self.mins = np.full(n_bands, np.inf)
+        self.maxs = np.full(n_bands, -np.inf)
+        self.sums = np.zeros(n_bands)
+        self.nulls = np.zeros(n_bands, dtype=np.int64)
+        self.all_nulls = 0
+        self.any_nulls = 0
+        self.outside = np.zeros(n_bands, dtype=np.int64)
+        self.histograms = np.zeros((n_bands, bins), dtype=np.int64)
+
+    def update(self, block: np.ndarray) -> None:
+        """
+        Adds a (bands, pixels) block.
+        """
+        if self.nodata is None:
+            null = np.zeros(block.shape, dtype=bool)
+        elif np.ndim(self.nodata):
+            null = np.isin(block, self.nodata)
+        else:
+            null = block == self.nodata
+        self.n_pixels += block.shape[1]
+        self.nulls += null.sum(axis=1)
+        self.all_nulls += int(null.all(axis=0).sum())
+        self.any_nulls += int(null.any(axis=0).sum())
+        for b in range(self.n_bands):
+            values = block[b][~null[b]]
+            if not values.size:
+                continue
+            self.mins[b] = min(self.mins[b], values.min())
+            self.maxs[b] = max(self.maxs[b], values.max())
+            self.sums[b] += values.sum(dtype=np.float64)
+            if self.valid_range is not None:
+                low, high = self.valid_range
+                self.outside[b] += int(((values < low) | (values > high)).sum())
+                self.histograms[b] += np.histogram(values, bins=self.edges)[0]
+
+    @property
+    def valid(self) -> np.ndarray:
+        return self.n_pixels - self.nulls
+
+    def band_min(self, b: int) -> float:
+        return None if not self.valid[b] else float(self.mins[b])
+
+    def band_max(self, b: int) -> float:
+        return None if not self.valid[b] else float(self.maxs[b])
+
+    def band_mean(self, b: int) -> float:
+        return None if not self.valid[b] else float(self.sums[b] / self.valid[b])
+
+    def null_pct(self) -> np.ndarray:
+        return 100 * self.nulls / self.n_pixels
+
+
+def accumulate_raster(path, nodata="file", **kwargs) -> BlockAccumulator:
+    """
+    Streams a raster block by block into a `BlockAccumulator`; memory is
+    bounded by one block of all the bands. `nodata="file"` uses the nodata
+    value of the file, None counts no pixel as null.
+    """
+    ds = gdal.Open(str(path))
+    n_bands = ds.RasterCount
+    if nodata == "file":
+        nodata = ds.GetRasterBand(1).GetNoDataValue()
+    accumulator = BlockAccumulator(n_bands, nodata, **kwargs)
+    for xoff, yoff, width, height in iter_block_windows(ds):
+        accumulator.update(ds.ReadAsArray(xoff, yoff, width, height).reshape(n_bands, -1))
+    ds = None
+    return accumulator
+
+
+def raster_band_stats(path, nodata: float = None) -> list:
+    """
+    Per-band min, max and null percentage, reading one block at a time.
+
+    Args:
+        path: Raster path.
+        nodata (float, optional): Null value. Defaults to the nodata of the file.
+
+    Returns:
+        list: One {"min", "max", "null_pct"} dict per band (min/max None if all null).
+    """
+    acc = accumulate_raster(path, "file" if nodata is None else nodata)
+    null_pct = acc.null_pct()
+    return [
+        {"min": acc.band_min(b), "max": acc.band_max(b), "null_pct": float(null_pct[b])}
+        for b in range(acc.n_bands)
+    ]
+
+
+def read_raster_metadata(path, stats: bool = True) -> dict:
+    """
+    Profile of a GeoTIFF (and, with `stats`, its per-band statistics).
+    """
+    ds = gdal.Open(str(path))
+    band = ds.GetRasterBand(1)
+    srs = osr.SpatialReference(wkt=ds.GetProjection())
+    srs.AutoIdentifyEPSG()
+    epsg = srs.GetAuthorityCode(None)
+    metadata = {
+        "driver": ds.GetDriver().ShortName,
+        "dtype": gdal.GetDataTypeName(band.DataType),
+        "width": ds.RasterXSize,
+        "height": ds.RasterYSize,
+        "count": ds.RasterCount,
+        "epsg": None if epsg is None else int(epsg),
+        "crs": None if epsg is None else f"EPSG:{epsg}",
+        "geotransform": list(ds.GetGeoTransform()),
+        "nodata": band.GetNoDataValue(),
+        "blocksize": list(band.GetBlockSize()),
+        "compression": ds.GetMetadataItem("COMPRESSION", "IMAGE_STRUCTURE"),
+        "interleave": ds.GetMetadataItem("INTERLEAVE", "IMAGE_STRUCTURE"),
+        "overviews": band.GetOverviewCount(),
+    }
+    ds = None
+    if stats:
+        metadata["bands"] = raster_band_stats(path, metadata["nodata"])
+    return metadata
+
+
+# ---------------------------------------------------------------------------------------------
+# Local null coverage (exact replacement of the server-side nullPercent)
+def raster_null_coverage(path, nodata: float = 65535) -> dict:
+    """
+    Exact null percentages of a local raster, read block by block.
+
+    Args:
+        path: Raster path.
+        nodata (float, optional): Null value(s): 65535 for the NEON mosaics of
+            `warp_neon_dir`; (0, 65535) for the S2 files, whose block copy in
+            `warp_single_tif` keeps the 0 fill (only the warp path maps it to
+            65535). Defaults to 65535.
+
+    Returns:
+        dict: 'band_null_pct' (one value per band), 'null_pct' (pixels null in
+            every band) and 'any_null_pct' (pixels null in at least one band).
+    """
+    acc = accumulate_raster(path, nodata)
+    return {
+        "band_null_pct": acc.null_pct().tolist(),
+        "null_pct": 100 * acc.all_nulls / acc.n_pixels,
+        "any_null_pct": 100 * acc.any_nulls / acc.n_pixels,
+    }
+
+
+def null_coverage_table(
+        paths: pd.Series,
+        workers: int = 8,
+        nodata: float = 65535
+    ) -> pd.DataFrame:
+    """
+    Runs `raster_null_coverage` for every path in a process pool.
+
+    Args:
+        paths (pd.Series): Raster paths (e.g. table["neon_root_path"]).
+        workers (int, optional): Number of processes. Defaults to 8.
+        nodata (float, optional): Null value. Defaults to 65535.
+
+    Returns:
+        pd.DataFrame: 'null_pct', 'any_null_pct' and 'band_null_pct' (JSON list)
+            with the index of `paths`; NaN for missing or unreadable files.
+    """
+    coverage = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(raster_null_coverage, path, nodata): index
+            for index, path in paths.items()
+            if pathlib.Path(path).exists()
+        }
+        for n, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            index = futures[future]
+            try:
+                result = future.result()
+                result["band_null_pct"] = json.dumps([round(v, 4) for v in result["band_null_pct"]])
+                coverage[index] = result
+            except Exception as e:
+                print(f"Error en {paths[index]}: {e}")
+            # Print progress every 100 files
+            if n % 100 == 0:
+                print(f"Processing {n}/{len(futures)}")
+
+    return pd.DataFrame.from_dict(coverage, orient="index").reindex(
+        paths.index, columns=["null_pct", "any_null_pct", "band_null_pct"]
+    )
+
+
+# ---------------------------------------------------------------------------------------------
+# SQLite sidecar keyed by (path, mtime, size)
+class RasterMetadataCache:
+    """
+    Raster profiles and band statistics stored in a SQLite sidecar.
+
+    Entries are keyed by the last `KEY_PARTS` path parts
+    ("<sensor>/<folder>/<neon_id>/<file name>") plus the file size and mtime,
+    not by the absolute path, so they survive moving the data to another root
+    (geotiff.py writes under OLD_SEN2NAIP/SuperSR, taco.py reads from
+    OLD_SEN2NEON) as long as the move keeps the mtime (mv, rsync -a, cp -p),
+    while the NEON and Sentinel-2 rasters of a sample, which share the file
+    name, keep separate entries. A file that changed gets a new key and is
+    read again. Fill it
+    right after writing a file (`record`) and let later stages use `get`.
+    Safe to share between processes.
+
+    Example:
+        cache = RasterMetadataCache("tables/raster_metadata.sqlite")
+        cache.get(path)["geotransform"]
+    """
+
+    def __init__(self, path="tables/raster_metadata.sqlite"):
+        self.path = pathlib.Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS rasters ("
+                "key TEXT, size INTEGER, mtime REAL, path TEXT, metadata TEXT, "
+                "PRIMARY KEY (key, size, mtime))"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path.as_posix(), timeout=60)
+
+    KEY_PARTS = 4
+
+    @classmethod
+    def key(cls, path) -> str:
+        return "/".join(pathlib.Path(path).parts[-cls.KEY_PARTS:])
+
+    def record(self, path, stats: bool = True) -> dict:
+        """
+        Reads the raster and stores its metadata.
+        """
+        path = pathlib.Path(path)
+        stat = path.stat()
+        metadata = read_raster_metadata(path, stats)
+        with self._connect() as con:
+            con.execute(
+                "INSERT OR REPLACE INTO rasters VALUES (?, ?, ?, ?, ?)",
+                (self.key(path), stat.st_size, stat.st_mtime, path.as_posix(), json.dumps(metadata))
+            )
+        return metadata
+
+    def get(self, path, stats: bool = True) -> dict:
+        """
+        Cached metadata of `path`, read again only if the file changed (or
+        `stats` are requested and were not stored).
+        """
+        path = pathlib.Path(path)
+        stat = path.stat()
+        with self._connect() as con:
+            found = con.execute(
+                "SELECT metadata FROM rasters WHERE key = ? AND size = ? AND mtime = ?",
+                (self.key(path), stat.st_size, stat.st_mtime)
+            ).fetchone()
+        if found is not None:
+            metadata = json.loads(found[0])
+            if not stats or "bands" in metadata:
+                return metadata
+        return self.record(path, stats)
+
+
+def cached_raster_metadata(path, metadata_cache=None, stats: bool = False) -> dict:
+    """
+    `read_raster_metadata` through a `RasterMetadataCache` (or its sidecar path)
+    when one is given.
+    """
+    if metadata_cache is None:
+        return read_raster_metadata(path, stats)
+    if not isinstance(metadata_cache, RasterMetadataCache):
+        metadata_cache = RasterMetadataCache(metadata_cache)
+    return metadata_cache.get(path, stats)
+
+
+def record_raster_metadata(path, metadata_cache=None) -> None:
+    """
+    Stores the metadata of a freshly written raster in `metadata_cache`
+    (a `RasterMetadataCache` or its sidecar path); no-op if None.
+    """
+    if metadata_cache is not None:
+        cached_raster_metadata(path, metadata_cache, stats=True)
+
+
+################
+## Validation ##
+################
+
+# ---------------------------------------------------------------------------------------------
+# One-pass block statistics, empty tiles, out-of-range values and duplicates
+REFLECTANCE_RANGE = (0, 10000)
+VALIDATION_COLUMNS = ["path", "n_pixels", "empty", "out_of_range", "null_pct", "bands", "error"]
+
+
+def validate_raster(
+        path,
+        nodata: float = 65535,
+        valid_range: tuple = REFLECTANCE_RANGE,
+        bins: int = 50
+    ) -> dict:
+    """
+    Streams a raster block by block and accumulates, for every band, min, max,
+    mean, null count, out-of-range count and a histogram over `valid_range`.
+    Memory is bounded by one block of all the bands.
+
+    Args:
+        path: Raster path.
+        nodata (float, optional): Null value. Defaults to 65535.
+        valid_range (tuple, optional): Expected (min, max) of the valid pixels
+            (scaled reflectance). Defaults to REFLECTANCE_RANGE.
+        bins (int, optional): Histogram bins over `valid_range`. Defaults to 50.
+
+    Returns:
+        dict: 'path', 'n_pixels', 'empty' (every pixel null in every band),
+            'out_of_range' (any valid pixel outside `valid_range`) and 'bands',
+            one {"min", "max", "mean", "null", "out_of_range", "histogram"} dict per band.
+    """
+    acc = accumulate_raster(path, nodata, valid_range=valid_range, bins=bins)
+    bands = [
+        {
+            "min": acc.band_min(b),
+            "max": acc.band_max(b),
+            "mean": acc.band_mean(b),
+            "null": int(acc.nulls[b]),
+            "out_of_range": int(acc.outside[b]),
+            "histogram": acc.histograms[b].tolist(),
+        }
+        for b in range(acc.n_bands)
+    ]
+    return {
+        "path": str(path),
+        "n_pixels": acc.n_pixels,
+        "empty": bool((acc.nulls == acc.n_pixels).all()),
+        "out_of_range": bool(acc.outside.any()),
+        "bands": bands,
+    }
+
+
+def validate_rasters(paths: list, workers: int = 8, **kwargs) -> pd.DataFrame:
+    """
+    Runs `validate_raster` for every path in a process pool.
+
+    Args:
+        paths (list): Raster paths.
+        workers (int, optional): Number of processes. Defaults to 8.
+        **kwargs: Passed to `validate_raster`.
+
+    Returns:
+        pd.DataFrame: One row per file with VALIDATION_COLUMNS ('bands' as JSON), in
+            input order; failed files only have 'path' and 'error'. All the columns
+            exist even if every file failed.
+    """
+    paths = [str(p) for p in paths]
+    reports = [None] * len(paths)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(validate_raster, path, **kwargs): i
+            for i, path in enumerate(paths)
+        }
+        for n, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            i = futures[future]
+            try:
+                report = future.result()
+                nulls = sum(band["null"] for band in report["bands"])
+                report["null_pct"] = 100 * nulls / (report["n_pixels"] * len(report["bands"]))
+                report["bands"] = json.dumps(report["bands"])
+            except Exception as e:
+                report = {"path": paths[i], "error": str(e)}
+            reports[i] = report
+            # Print progress every 100 files
+            if n % 100 == 0:
+                print(f"Processing {n}/{len(paths)}")
+    return pd.DataFrame(reports, columns=VALIDATION_COLUMNS)
+
+
+def inconsistent_duplicates(report: pd.DataFrame, groups: pd.Series, atol: float = 0) -> pd.DataFrame:
+    """
+    Files expected to be copies of the same tile (same value in `groups`,
+    e.g. their directory) whose band statistics (min, max, mean, null) differ.
+
+    Args:
+        report (pd.DataFrame): Output of `validate_rasters`.
+        groups (pd.Series): Group key of every row of `report`.
+        atol (float, optional): Tolerance on the band means. Defaults to 0.
+
+    Returns:
+        pd.DataFrame: Rows of `report` in inconsistent groups, with a 'group' column.
+    """
+    report = report.assign(group=groups.to_numpy())
+    if "bands" not in report.columns:
+        return report.iloc[:0]
+    report = report.dropna(subset=["bands"])
+
+    def summary(bands: str) -> np.ndarray:
+        return np.array([
+            [np.nan if band[k] is None else band[k] for k in ("min", "max", "mean", "null")]
+            for band in json.loads(bands)
+        ])
+
+    inconsistent = []
+    for group, files in report.groupby("group", sort=False):
+        if len(files) < 2:
+            continue
+        summaries = [summary(bands) for bands in files["bands"]]
+        first = summaries[0]
+        if any(
+            s.shape != first.shape or not np.allclose(s, first, rtol=0, atol=atol, equal_nan=True)
+            for s in summaries[1:]
+        ):
+            inconsistent.append(files)
+    if not inconsistent:
+        return report.iloc[:0]
+    return pd.concat(inconsistent)
+
+
+#####################
+## TACO packaging  ##
+#####################
+
+# ---------------------------------------------------------------------------------------------
+# Tortilla creation (one tortilla per row, LR + HR samples)
+def raster_stac_data(path, metadata_cache=None) -> dict:
+    """
+    STAC raster fields of a GeoTIFF (crs, geotransform, raster_shape), from the
+    metadata cache when given (see `RasterMetadataCache`).
+    """
+    metadata = cached_raster_metadata(path, metadata_cache)
+    return {
+        "crs": metadata["crs"],
+        "geotransform": tuple(metadata["geotransform"]),
+        "raster_shape": (metadata["height"], metadata["width"]),
+    }
+
+
+def tortilla_is_current(row: dict) -> bool:
+    """
+    True if the tortilla exists and is newer than both of its rasters.
+    """
+    tortilla = pathlib.Path(row["tortilla_path"])
+    if not tortilla.exists():
+        return False
+    inputs_mtime = max(pathlib.Path(row[c]).stat().st_mtime for c in ["s2_root_path", "neon_root_path"])
+    return tortilla.stat().st_mtime > inputs_mtime
+
+
+def tortilla_stac_data(row: dict, metadata_cache=None) -> dict:
+    """
+    STAC fields of a tortilla (those of its HR sample), i.e. what
+    `tacoreader.load(tortilla).iloc[1]` returns as 'stac:*'.
+    """
+    neon_date = datetime.datetime.strptime(row["neon_date"], '%Y-%m-%d')
+    return {
+        **raster_stac_data(row["neon_root_path"], metadata_cache),
+        "centroid": f"POINT ({row['lon_c']} {row['lat_c']})",
+        "time_start": neon_date,
+        "time_end": neon_date,
+    }
+
+
+def build_tortilla(
+        row: dict,
+        force: bool = False,
+        need_metadata: bool = True,
+        metadata_cache: str = None
+    ) -> Tuple[str, dict]:
+    """
+    Creates the tortilla of one row of the updated pairs table.
+
+    Args:
+        row (dict): Row with 's2_root_path', 'neon_root_path', 'tortilla_path',
+            dates, centroid and quality columns.
+        force (bool, optional): Rebuild even if the tortilla is up to date. Defaults to False.
+        need_metadata (bool, optional): Return the STAC fields of a skipped tortilla
+            (read from its HR raster). Defaults to True.
+        metadata_cache (str, optional): `RasterMetadataCache` sidecar used instead
+            of opening the rasters. Defaults to None.
+
+    Returns:
+        Tuple[str, dict]: "created" or "skipped", and the tortilla STAC fields
+            (`tortilla_stac_data`, None if skipped without `need_metadata`).
+    """
+    import tacotoolbox  # only needed for packaging
+
+    if not force and tortilla_is_current(row):
+        return "skipped", (tortilla_stac_data(row, metadata_cache) if need_metadata else None)
+
+    centroid = f"POINT ({row['lon_c']} {row['lat_c']})"
+    s2_date = datetime.datetime.strptime(row["s2_date"], '%Y-%m-%d')
+
+    # Low-resolution (LR) image
+    sample_lr = tacotoolbox.tortilla.datamodel.Sample(
+        id="lr",
+        path=row["s2_root_path"],
+        file_format="GTiff",
+        data_split="train",
+        stac_data={
+            **raster_stac_data(row["s2_root_path"], metadata_cache),
+            "time_start": s2_date,
+            "time_end": s2_date,
+            "centroid": centroid
+        },
+        s2_id_gee=row["s2_id_gee"],
+        cloud_perc=((1 - row["cs_cdf"]) * 100)
+    )
+
+    # High-resolution (HR) image
+    stac_hr = tortilla_stac_data(row, metadata_cache)
+    sample_hr = tacotoolbox.tortilla.datamodel.Sample(
+        id="hr",
+        path=row["neon_root_path"],
+        file_format="GTiff",
+        data_split="train",
+        stac_data=stac_hr,
+        s2_id_gee=row["neon_id_gee"],
+        neon_val_null=row["neon_val_null"]
+    )
+
+    samples = tacotoolbox.tortilla.datamodel.Samples(samples=[sample_lr, sample_hr])
+
+    pathlib.Path(row["tortilla_path"]).parent.mkdir(parents=True, exist_ok=True)
+    tacotoolbox.tortilla.create(samples, row["tortilla_path"], quiet=True)
+    return "created", stac_hr
+
+
+def build_tortillas(
+        table: pd.DataFrame,
+        workers: int = 8,
+        force: bool = False,
+        metadata_path: str = None,
+        metadata_cache: str = None
+    ) -> Tuple[collections.Counter, pd.DataFrame]:
+    """
+    Runs `build_tortilla` for every row of `table` in a process pool and
+    collects the STAC fields of every tortilla, so the collection can be
+    assembled without `tacoreader.load` on each file.
+
+    Args:
+        table (pd.DataFrame): Updated pairs table with a 'tortilla_path' column.
+        workers (int, optional): Number of processes. Defaults to 8.
+        force (bool, optional): Rebuild all tortillas. Defaults to False.
+        metadata_path (str, optional): Parquet side table with the STAC fields. Rows
+            already in it are not re-read when their tortilla is skipped; it is
+            rewritten at the end. Defaults to None.
+        metadata_cache (str, optional): `RasterMetadataCache` sidecar for the raster
+            profiles. Defaults to None.
+
+    Returns:
+        Tuple[collections.Counter, pd.DataFrame]: Number of rows "created", "skipped"
+            and "failed", and the STAC fields plus 'tortilla_size' (bytes) indexed by
+            'tortilla_path'. Failed rows are left out.
+    """
+    rows = table.to_dict("records")
+    status = collections.Counter()
+
+    known = pd.DataFrame()
+    if metadata_path is not None and pathlib.Path(metadata_path).exists():
+        known = pd.read_parquet(metadata_path).set_index("tortilla_path")
+
+    metadata = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(
+                build_tortilla, row, force, row["tortilla_path"] not in known.index, metadata_cache
+            ): i
+            for i, row in enumerate(rows)
+        }
+        for n, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            path = rows[futures[future]]["tortilla_path"]
+            try:
+                result, stac_data = future.result()
+                status[result] += 1
+                stac_data = stac_data if stac_data is not None else known.loc[path].to_dict()
+                metadata[path] = {**stac_data, "tortilla_size": os.path.getsize(path)}
+            except Exception as e:
+                print(f"Error en la tortilla {path}: {e}")
+                status["failed"] += 1
+            # Print progress every 100 rows
+            if n % 100 == 0:
+                print(f"Processing {n}/{len(rows)}")
+
+    metadata = pd.DataFrame.from_dict(metadata, orient="index")
+    metadata.index.name = "tortilla_path"
+    if metadata_path is not None:
+        metadata.reset_index().to_parquet(metadata_path, index=False)
+
+    return status, metadata
+
+
+# ---------------------------------------------------------------------------------------------
+# Size-balanced taco parts
+def plan_taco_parts(
+        sizes: pd.Series,
+        target_bytes: int = 5 * 1024**3,
+        groups: pd.Series = None
+    ) -> pd.DataFrame:
+    """
+    Splits tortillas into parts of near-equal bytes.
+
+    The number of parts is ceil(total / target_bytes) and items are assigned,
+    largest first, to the lightest part (greedy LPT bin-packing). With `groups`
+    (e.g. table["folder"]) the tortillas of a group stay together for spatial
+    locality; groups larger than `target_bytes` are cut into consecutive
+    chunks first.
+
+    Args:
+        sizes (pd.Series): Tortilla size in bytes, indexed by tortilla path.
+        target_bytes (int, optional): Target part size. Defaults to 5 GiB.
+        groups (pd.Series, optional): Group of every tortilla (same index). Defaults to None.
+
+    Returns:
+        pd.DataFrame: Part manifest with 'tortilla_path', 'size', 'group' and 'part',
+            sorted by part and keeping the input order inside each part.
+    """
+    manifest = pd.DataFrame({
+        "tortilla_path": sizes.index,
+        "size": sizes.to_numpy(dtype=np.int64),
+        "group": np.arange(len(sizes)) if groups is None else groups.reindex(sizes.index).to_numpy(),
+    })
+
+    # Items to pack: whole groups, or chunks of at most target_bytes of a group
+    items = np.zeros(len(manifest), dtype=int)
+    n_items = 0
+    for _, group in manifest.groupby("group", sort=False):
+        chunk = np.cumsum(group["size"].to_numpy()) // max(target_bytes, 1)
+        items[manifest.index.get_indexer(group.index)] = n_items + chunk
+        n_items += int(chunk.max()) + 1
+    manifest["item"] = items
+
+    item_sizes = manifest.groupby("item")["size"].sum().sort_values(ascending=False, kind="stable")
+    n_parts = max(1, min(len(item_sizes), math.ceil(manifest["size"].sum() / target_bytes)))
+    heap = [(0, part) for part in range(n_parts)]
+    item_part = {}
+    for item, size in item_sizes.items():
+        load, part = heapq.heappop(heap)
+        item_part[item] = part
+        heapq.heappush(heap, (load + int(size), part))
+
+    manifest["part"] = manifest["item"].map(item_part)
+    return manifest.drop(columns="item").sort_values("part", kind="stable").reset_index(drop=True)
+
+
+#######################
+## Training cache    ##
+#######################
+
+# ---------------------------------------------------------------------------------------------
+# Pre-decoded .npy shards (np.memmap reads, no decompression per epoch)
+def _decode_sample(
+        lr_path,
+        hr_path,
+        lr_out: np.ndarray,
+        hr_out: np.ndarray,
+        bands: list,
+        dtype: str,
+        nodata: float,
+        scale: float
+    ) -> None:
+    # Written straight into the shard slot: at most one sample per worker is in memory
+    for path, out in ((lr_path, lr_out), (hr_path, hr_out)):
+        ds = gdal.Open(str(path))
+        data = ds.ReadAsArray(band_list=bands)
+        data = data.reshape(-1, ds.RasterYSize, ds.RasterXSize)
+        ds = None
+        if np.dtype(dtype).kind == "f":
+            null = data == nodata
+            data = (data / scale).astype(dtype)
+            data[null] = np.nan
+        out[:] = data
+
+
+def export_npy_shards(
+        lr_paths: list,
+        hr_paths: list,
+        out_dir,
+        ids: list = None,
+        bands: list = None,
+        dtype: str = "uint16",
+        shard_size: int = 256,
+        workers: int = 8,
+        nodata: float = 65535,
+        scale: float = 10000
+    ) -> pd.DataFrame:
+    """
+    Decodes LR/HR raster pairs into uncompressed .npy shards that can be
+    memory-mapped (see `sen2neon_reader.NpyShardStore`).
+
+    Samples with the same LR/HR shapes are stacked in shards
+    lr_NNNNN.npy (N, bands, H, W) and hr_NNNNN.npy, written in place through
+    `np.lib.format.open_memmap` (each decoding thread writes its own slot, so
+    only ~`workers` samples are in memory); 'index.parquet' maps every sample to its
+    shard and position and 'meta.json' keeps the bands and dtype.
+
+    Args:
+        lr_paths (list): LR rasters (e.g. table["s2_root_path"]).
+        hr_paths (list): HR rasters (e.g. table["neon_root_path"]).
+        out_dir: Output directory.
+        ids (list, optional): Sample ids. Defaults to 0..n-1.
+        bands (list, optional): 1-based bands to keep. Defaults to all.
+        dtype (str, optional): "uint16" (raw values) or "float16" (values / `scale`,
+            `nodata` as NaN). Defaults to "uint16".
+        shard_size (int, optional): Samples per shard. Defaults to 256.
+        workers (int, optional): Decoding threads. Defaults to 8.
+        nodata (float, optional): Null value. Defaults to 65535.
+        scale (float, optional): Reflectance scale for float dtypes. Defaults to 10000.
+
+    Returns:
+        pd.DataFrame: The index ('id', 'lr_path', 'hr_path', 'shard', 'position').
+    """
+    out_dir = pathlib.Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    lr_paths = [str(p) for p in lr_paths]
+    hr_paths = [str(p) for p in hr_paths]
+    ids = list(range(len(lr_paths))) if ids is None else list(ids)
+
+    def shape(path) -> Tuple[int, int, int]:
+        ds = gdal.Open(path)
+        n_bands = ds.RasterCount if bands is None else len(bands)
+        shape = (n_bands, ds.RasterYSize, ds.RasterXSize)
+        ds = None
+        return shape
+
+    samples = pd.DataFrame({"id": ids, "lr_path": lr_paths, "hr_path": hr_paths})
+    samples["lr_shape"] = [shape(p) for p in lr_paths]
+    samples["hr_shape"] = [shape(p) for p in hr_paths]
+
+    index = []
+    shard = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        for (lr_shape, hr_shape), group in samples.groupby(["lr_shape", "hr_shape"], sort=False):
+            for start in range(0, len(group), shard_size):
+                chunk = group.iloc[start:start + shard_size]
+                lr = np.lib.format.open_memmap(
+                    out_dir / f"lr_{shard:05d}.npy", mode="w+", dtype=dtype, shape=(len(chunk), *lr_shape)
+                )
+                hr = np.lib.format.open_memmap(
+                    out_dir / f"hr_{shard:05d}.npy", mode="w+", dtype=dtype, shape=(len(chunk), *hr_shape)
+                )
+                # Each task decodes one sample into its own slot and returns nothing,
+                # so memory stays at ~`workers` samples whatever the shard size
+                futures = [
+                    executor.submit(
+                        _decode_sample, lr_path, hr_path, lr[position], hr[position],
+                        bands, dtype, nodata, scale
+                    )
+                    for position, (lr_path, hr_path) in enumerate(zip(chunk["lr_path"], chunk["hr_path"]))
+                ]
+                for future in concurrent.futures.as_completed(futures):
+                    future.result()
+                lr.flush()
+                hr.flush()
+                del lr, hr
+
+                index.append(chunk[["id", "lr_path", "hr_path"]].assign(
+                    shard=shard, position=np.arange(len(chunk))
+                ))
+                print(f"Shard {shard}: {len(chunk)} samples {lr_shape} / {hr_shape}")
+                shard += 1
+
+    index = pd.concat(index, ignore_index=True)
+    index.to_parquet(out_dir / "index.parquet", index=False)
+    (out_dir / "meta.json").write_text(json.dumps({
+        "bands": bands, "dtype": np.dtype(dtype).name, "nodata": nodata, "scale": scale
+    }))
+    return index
+
+
+#################
+## Publishing  ##
+#################
+
+# ---------------------------------------------------------------------------------------------
+# Resumable Hugging Face upload (one commit, parallel LFS pre-upload, JSONL journal)
+class PublishJournal:
+    """
+    Append-only JSONL record of a publishing run, one line per event and
+    file ("hashed", "preuploaded", "failed", "committed"); the last line of a
+    file wins. Local hashes are reused while the file keeps its size and mtime,
+    so a restarted run neither hashes multi-GB parts again nor repeats the
+    pre-uploads it had finished.
+    """
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        self.records = {}
+        self._lock = threading.Lock()
+
+        if self.path.exists():
+            with open(self.path) as src:
+                for line in src:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # truncated last line after a crash
+                    self.records[record["path_in_repo"]] = record
+
+    def append(self, record: dict) -> None:
+        with self._lock:
+            self.records[record["path_in_repo"]] = record
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a") as dst:
+                dst.write(json.dumps(record) + "\n")
+                dst.flush()
+
+    def local_hash(self, path_in_repo: str, local_path) -> dict:
+        """
+        {"size", "mtime", "sha256"} of a local file, from the journal when current.
+        """
+        stat = pathlib.Path(local_path).stat()
+        record = self.records.get(path_in_repo)
+        if (
+            record is not None
+            and record["local_path"] == str(local_path)
+            and record["size"] == stat.st_size
+            and record["mtime"] == stat.st_mtime
+        ):
+            return {k: record[k] for k in ("size", "mtime", "sha256")}
+        record = {
+            "path_in_repo": path_in_repo,
+            "local_path": str(local_path),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "sha256": file_checksum([local_path]),
+            "status": "hashed",
+        }
+        self.append(record)
+        return {k: record[k] for k in ("size", "mtime", "sha256")}
+
+    def mark(self, path_in_repo: str, status: str, **extra) -> None:
+        self.append({**self.records[path_in_repo], "status": status, **extra})
+
+
+def remote_files(api, repo_id: str, repo_type: str = "dataset") -> dict:
+    """
+    {path_in_repo: {"size", "sha256"}} of the files of a Hub repository
+    (sha256 only for LFS files).
+    """
+    files = {}
+    for item in api.list_repo_tree(repo_id=repo_id, repo_type=repo_type, recursive=True):
+        if getattr(item, "size", None) is None:
+            continue  # folder
+        lfs = getattr(item, "lfs", None)
+        files[item.path] = {"size": item.size, "sha256": None if lfs is None else lfs.sha256}
+    return files
+
+
+def hub_addition(path_in_repo: str, local_path, local: dict, upload_mode: str = None):
+    """
+    `CommitOperationAdd` built from the journaled {"size", "sha256"} of a file.
+
+    `CommitOperationAdd(...)` hashes the whole file in `__post_init__`; here the
+    upload info is filled from the journal instead (only the 512-byte sample is
+    read). With `upload_mode="lfs"` the operation is marked as already uploaded,
+    so `create_commit` does not pre-upload it again.
+    """
+    from huggingface_hub import CommitOperationAdd  # only needed for publishing
+    from huggingface_hub.lfs import UploadInfo
+
+    with open(local_path, "rb") as src:
+        sample = src.read(512)
+    operation = CommitOperationAdd.__new__(CommitOperationAdd)
+    operation.path_in_repo = path_in_repo
+    operation.path_or_fileobj = str(local_path)
+    operation.upload_info = UploadInfo(
+        sha256=bytes.fromhex(local["sha256"]), size=local["size"], sample=sample
+    )
+    if upload_mode == "lfs":
+        operation._upload_mode = "lfs"
+        operation._is_uploaded = True
+    return operation
+
+
+def publish_to_hub(
+        api,
+        repo_id: str,
+        uploads: dict,
+        deletions: list = (),
+        repo_type: str = "dataset",
+        journal_path: str = "tables/hf_publish.jsonl",
+        workers: int = 4,
+        commit_message: str = "Upload: taco parts"
+    ) -> collections.Counter:
+    """
+    Publishes files to a Hugging Face repository in a single commit.
+
+    Local files are hashed (in parallel, reusing the journal), those already on
+    the Hub with the same sha256 (or size, for non-LFS files) are skipped, the
+    rest are pre-uploaded with `api.preupload_lfs_files` by `workers` threads,
+    and every upload and deletion goes into one `api.create_commit`. The commit
+    operations are built from the journaled hashes (`hub_addition`), so each
+    file is hashed once. If any pre-upload fails nothing is committed. Running
+    again resumes: LFS files whose journal entry is "preuploaded" with the same
+    hash are marked as uploaded and neither this function nor `create_commit`
+    pre-uploads them again.
+
+    Args:
+        api: `huggingface_hub.HfApi` (or a mock with list_repo_tree,
+            preupload_lfs_files and create_commit).
+        repo_id (str): Repository id.
+        uploads (dict): {path_in_repo: local path}.
+        deletions (list, optional): Paths in the repository to delete. Defaults to ().
+        repo_type (str, optional): Repository type. Defaults to "dataset".
+        journal_path (str, optional): JSONL progress journal. Defaults to "tables/hf_publish.jsonl".
+        workers (int, optional): Parallel pre-uploads. Defaults to 4.
+        commit_message (str, optional): Commit message.
+
+    Returns:
+        collections.Counter: Number of files "skipped", "uploaded", "resumed"
+            (pre-uploaded by an earlier run) and "deleted".
+    """
+    from huggingface_hub import CommitOperationDelete  # only needed for publishing
+
+    journal = PublishJournal(journal_path)
+    remote = remote_files(api, repo_id, repo_type)
+    status = collections.Counter()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        hashes = dict(zip(uploads, executor.map(journal.local_hash, uploads, uploads.values())))
+
+    additions = []
+    for path_in_repo, local_path in uploads.items():
+        found = remote.get(path_in_repo)
+        local = hashes[path_in_repo]
+        if found is not None and (
+            found["sha256"] == local["sha256"]
+            if found["sha256"] is not None
+            else found["size"] == local["size"]
+        ):
+            status["skipped"] += 1
+            continue
+        # Pre-uploads finished by an interrupted run (the journal entry is reset
+        # to "hashed" whenever the local file changes)
+        record = journal.records[path_in_repo]
+        resumed = record["status"] == "preuploaded" and record.get("upload_mode") == "lfs"
+        if resumed:
+            status["resumed"] += 1
+        additions.append(hub_addition(path_in_repo, local_path, local, "lfs" if resumed else None))
+    removals = [
+        CommitOperationDelete(path_in_repo=path)
+        for path in deletions
+        if path in remote and path not in uploads
+    ]
+
+    def preupload(operation) -> None:
+        api.preupload_lfs_files(repo_id, additions=[operation], repo_type=repo_type)
+        # "regular" files are sent inline by create_commit, only LFS ones can be resumed
+        journal.mark(operation.path_in_repo, "preuploaded", upload_mode=operation._upload_mode)
+        print(f"File preuploaded: {operation.path_in_repo}")
+
+    pending = [op for op in additions if not op._is_uploaded]
+
+    failed = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(preupload, op): op.path_in_repo for op in pending}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                journal.mark(futures[future], "failed", error=str(e))
+                failed.append(futures[future])
+    if failed:
+        raise RuntimeError(f"{len(failed)} pre-uploads failed, nothing committed: {failed}")
+
+    if additions or removals:
+        api.create_commit(
+            repo_id=repo_id,
+            operations=additions + removals,
+            commit_message=commit_message,
+            repo_type=repo_type
+        )
+        for op in additions:
+            journal.mark(op.path_in_repo, "committed")
+    status["uploaded"] = len(additions)
+    status["deleted"] = len(removals)
+    return status